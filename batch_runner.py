@@ -0,0 +1,199 @@
+from collections import Counter, namedtuple
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+import parallel_reader
+from report_cache import ReportCache
+from report_schema import DEBUG_SHEETS, job_arguments
+
+
+"""
+
+Batch of comparisons of OrderDiscrepancyComparisonScript, e.g. of many clients at once.
+Jobs are read from a manifest (see 'read_batch_manifest') and run in a pool of processes,
+debug files used by several jobs are parsed once before the jobs start and given to all of them.
+A summary of the jobs timings and failures is printed at the end.
+
+	python script_v1.4.py jobs.json [concurrency]
+	python script_v1.4.py 'files/to_comp_*' [concurrency]
+
+The comparison class and the shared debug sheets are given to the pool processes by their initializer,
+so the jobs run the same way whether the processes are forked or started anew (as on Windows).
+
+"""
+
+# Names of the input files in a job directory of a batch
+BATCH_JOB_FILES = {
+	'old_version': 'old_version.csv',
+	'new_version': 'new_version.csv',
+	'reimbursements': 'reimbursements.csv',
+	'returns_to_fba': 'returns_to_fba.csv',
+	'date_range': 'date_range.csv',
+}
+
+# Arguments a JSON job cannot go without
+REQUIRED_JOB_ARGUMENTS = ('old_version', 'new_version')
+
+BatchJobResult = namedtuple('BatchJobResult', ['name', 'seconds', 'output_file', 'error'])
+
+# State of a batch process set by '_init_batch_process': {'comparison_class': ..., 'shared_debug_aggregates': ...}
+_batch_process = {}
+
+
+
+def read_batch_manifest(manifest):
+	"""
+	Get the comparison jobs of a batch from a manifest. It's either a JSON file with paths relative to it:
+
+		{"jobs": [{"name": "Jacob", "old_version": "to_comp_Jacob/51.csv", "new_version": "to_comp_Jacob/26.csv",
+		  "reimbursements": "to_comp_Jacob/reimbursements.csv", ...}]}
+
+	or a glob of job directories (e.g. 'files/to_comp_*'), each one has the files named as in BATCH_JOB_FILES.
+	A JSON job may have a 'debug_report' workbook instead of the debug csv files.
+	Output files are put to the directory of the old version (or to 'output_dir' of a JSON job).
+	A JSON job which cannot be run (e.g. without 'old_version') doesn't stop the batch, it fails alone:
+	it has the 'error' instead of the arguments.
+
+	:param manifest: A JSON file or a glob of directories
+	:return: A list of dicts with job 'name' and OrderDiscrepancyComparisonScript arguments (or 'error')
+	"""
+	jobs = []
+	if os.path.isfile(manifest):
+		base_dir = os.path.dirname(os.path.abspath(manifest))
+		with open(manifest, 'rb') as manifest_file:
+			manifest_jobs = json.load(manifest_file)
+		if not isinstance(manifest_jobs, dict) or not isinstance(manifest_jobs.get('jobs'), list):
+			raise ValueError('{}: a manifest has to be a JSON object with a list of "jobs"'.format(manifest))
+		for job_number, job in enumerate(manifest_jobs['jobs'], 1):
+			jobs.append(_manifest_job(job, job_number, base_dir))
+	else:
+		for job_dir in sorted(glob.glob(manifest)):
+			if os.path.isdir(job_dir):
+				job = dict((argument, os.path.join(job_dir, file_name)) for argument, file_name in BATCH_JOB_FILES.iteritems())
+				job['name'] = os.path.basename(job_dir.rstrip('/'))
+				job['output_dir'] = job_dir
+				jobs.append(job)
+	return jobs
+
+
+def run_batch(comparison_class, manifest, concurrency=None, **options):
+	"""
+	Run all the comparison jobs of a manifest in a pool of 'concurrency' processes (number of CPUs by default).
+	Debug files used by several jobs are parsed once before the jobs start.
+	A summary of the jobs timings and failures is printed at the end.
+
+	:param comparison_class: OrderDiscrepancyComparisonScript
+	:param manifest: A JSON file or a glob of job directories, see 'read_batch_manifest'
+	:param concurrency: Max number of jobs running at the same time
+	:param options: OrderDiscrepancyComparisonScript arguments for all the jobs, e.g. output_format='csv'.
+		Jobs run in the batch pool processes, which cannot have children, so 'workers' of a job doesn't start a pool,
+		its files are parsed in its batch process
+	:return: A list of BatchJobResult
+	"""
+	jobs = read_batch_manifest(manifest)
+	start = time.time()
+
+	debug_files_usage = Counter(
+		(sheet, _job_debug_file(job, sheet)) for job in jobs for sheet in DEBUG_SHEETS if _job_debug_file(job, sheet))
+	shared_debug_files = [debug_file for debug_file, jobs_count in debug_files_usage.iteritems() if jobs_count > 1]
+	shared_debug_aggregates = {} # {(sheet, path): partial results}
+	if shared_debug_files:
+		print 'Parsing {} shared debug files...'.format(len(shared_debug_files))
+		cache = ReportCache(options['cache_dir'], options.get('cache_size')) if options.get('cache_dir') else None
+		reader = parallel_reader.ParallelReader(concurrency, cache=cache)
+		try:
+			partials = [(debug_file, reader.submit(*debug_file)) for debug_file in shared_debug_files]
+			shared_debug_aggregates.update((debug_file, result.get()) for debug_file, result in partials)
+		finally:
+			reader.close()
+
+	pool = multiprocessing.Pool(concurrency, _init_batch_process, (comparison_class, shared_debug_aggregates))
+	try:
+		results = pool.map(_run_batch_job, [(job, options) for job in jobs])
+	finally:
+		pool.close()
+		pool.join()
+
+	failed = [result for result in results if result.error]
+	print
+	print 'Batch summary: {} jobs, {} failed, {:.1f}s'.format(len(results), len(failed), time.time() - start)
+	for result in results:
+		print '  {:<30} {:>8.1f}s  {:<6}  {}'.format(
+			result.name, result.seconds, 'FAILED' if result.error else 'OK', result.error or result.output_file)
+	return results
+
+
+def check_batch(comparison_class, manifest, options):
+	"""
+	Dry run of all the jobs of a batch (see 'check_inputs' of OrderDiscrepancyComparisonScript), the failed ones are printed
+	:return: An exit status
+	"""
+	failed = 0
+	for job in read_batch_manifest(manifest):
+		arguments = dict(job, **options)
+		name = arguments.pop('name')
+		if 'error' in job:
+			failed += 1
+			print '  {:<30} FAILED  {}'.format(name, job['error'])
+			continue
+		try:
+			comparison_class(**arguments).check_inputs()
+		except (EOFError, ValueError, TypeError, IOError, ImportError) as error:
+			failed += 1
+			print '  {:<30} FAILED  {}: {}'.format(name, type(error).__name__, error)
+		else:
+			print '  {:<30} OK'.format(name)
+	return 1 if failed else 0
+
+
+def _manifest_job(job, job_number, base_dir):
+	# Arguments of a JSON job with the paths relative to the manifest,
+	# a job which cannot be run gets its 'name' (or number) and the 'error' only
+	arguments = job_arguments(job) if isinstance(job, dict) else {}
+	name = arguments.get('name') or 'job {}'.format(job_number)
+	if not isinstance(job, dict):
+		return {'name': name, 'error': 'A job has to be a JSON object of its arguments'}
+	missing = [argument for argument in REQUIRED_JOB_ARGUMENTS if not arguments.get(argument)]
+	if missing:
+		return {'name': name, 'error': '{} not given, the job has {}'.format(
+			' and '.join(repr(argument) for argument in missing), ', '.join(sorted(repr(argument) for argument in arguments)))}
+
+	for argument in BATCH_JOB_FILES.keys() + ['output_dir', 'debug_report']:
+		if arguments.get(argument):
+			arguments[argument] = os.path.join(base_dir, arguments[argument])
+	arguments.setdefault('output_dir', os.path.dirname(arguments['old_version']))
+	arguments.setdefault('name', os.path.basename(arguments['output_dir']))
+	return arguments
+
+
+def _job_debug_file(job, sheet):
+	# A sheet of a job is read from its csv file or from the debug report workbook, as OrderDiscrepancyComparisonScript does
+	return job.get(sheet) or job.get('debug_report')
+
+
+def _init_batch_process(comparison_class, shared_debug_aggregates):
+	_batch_process.update(comparison_class=comparison_class, shared_debug_aggregates=shared_debug_aggregates)
+
+
+def _run_batch_job(job_and_options):
+	job, options = job_and_options
+	if 'error' in job: # It cannot be run, see 'read_batch_manifest'
+		return BatchJobResult(job['name'], 0.0, None, job['error'])
+	shared_debug_aggregates = _batch_process['shared_debug_aggregates']
+	arguments = dict(job, **options)
+	name = arguments.pop('name')
+	arguments['debug_aggregates'] = dict(
+		(sheet, shared_debug_aggregates[(sheet, _job_debug_file(job, sheet))])
+		for sheet in DEBUG_SHEETS if (sheet, _job_debug_file(job, sheet)) in shared_debug_aggregates
+	)
+
+	start = time.time()
+	try:
+		comparison = _batch_process['comparison_class'](**arguments)
+		comparison.run_script()
+	except Exception as error:
+		return BatchJobResult(name, time.time() - start, None, '{}: {}'.format(type(error).__name__, error))
+	return BatchJobResult(name, time.time() - start, comparison.output_file_name, None)
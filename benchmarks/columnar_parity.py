@@ -0,0 +1,125 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+
+from columnar_reasons import run_engine, script
+
+
+"""
+
+Parity check of the 'dict' and 'columnar' engines on a few hand-written keys, one for each case
+of the debug join and the reasons check: duplicated version rows, keys missing from debug,
+refund-only keys, more refunds than orders, refunds which are returned, keys in Reimbursements or ReturnsToFBA only,
+empty quantities and debug keys which are in neither version. It takes a second, unlike
+'columnar_reasons', and exits with status 1 if 'reports_data' of the engines differs for any key
+or if a case doesn't get the reason it's written for.
+
+Usage: python benchmarks/columnar_parity.py
+
+"""
+
+MISSING_REASONS = script.OrderDiscrepancyComparisonScript.reasons
+
+# Keys by their case: (old version rows, new version rows, expected reason of a missing key)
+KEYS = {
+	'in both': (1, 1, None),
+	'duplicated in both': (2, 2, None),
+	'more rows in old': (3, 1, MISSING_REASONS['should_be_in_report']),
+	'not in debug': (1, 0, MISSING_REASONS['not_in_debug']),
+	'duplicated, not in debug': (0, 2, MISSING_REASONS['not_in_debug']),
+	'refund only': (0, 1, MISSING_REASONS['refund_without_order']),
+	'more refunds': (1, 0, MISSING_REASONS['refunds_qty_greater_than_orders']),
+	'returned refunds': (1, 0, MISSING_REASONS['unknown']),
+	'reimbursed only': (1, 0, None),
+	'returned only': (0, 1, None),
+	'empty quantities': (1, 0, None),
+	'debug only': (0, 0, None),
+}
+
+# DateRangeCSV rows of the keys: (type, quantity)
+DATE_RANGE = {
+	'in both': [('Order', '1')],
+	'more rows in old': [('Order', '2'), ('Order', '1'), ('Refund', '1')],
+	'refund only': [('Refund', '1'), ('Refund', '2')],
+	'more refunds': [('Order', '1'), ('Refund', '2')],
+	'returned refunds': [('Order', '3'), ('Refund', '1')],
+	'empty quantities': [('Order', ''), ('Refund', '')],
+	'debug only': [('Order', '1')],
+}
+
+REIMBURSEMENTS = {'reimbursed only': ['1'], 'more refunds': ['0', '1'], 'empty quantities': ['']}
+
+RETURNS_TO_FBA = {'returned only': ['2'], 'returned refunds': ['1'], 'debug only': ['1']}
+
+
+def order_sku(case):
+	number = sorted(KEYS).index(case)
+	return '{:03d}-{:07d}'.format(number, number * 7919), 'SKU{}_FBA'.format(number)
+
+
+def write_csv(file_name, header, rows):
+	with open(file_name, 'wb') as csvfile:
+		writer = csv.writer(csvfile, delimiter=',')
+		writer.writerow(header)
+		writer.writerows(rows)
+
+
+def make_files(directory):
+	# The layouts of the files are the same as 'columnar_reasons' makes
+	for version, rows_index in (('old.csv', 0), ('new.csv', 1)):
+		write_csv(os.path.join(directory, version), ['', 'order_id', 'sku'], [
+			[''] + list(order_sku(case)) for case in sorted(KEYS) for _ in xrange(KEYS[case][rows_index])
+		])
+
+	reimbursements = []
+	for case, quantities in sorted(REIMBURSEMENTS.iteritems()):
+		for quantity in quantities:
+			row = [''] * 16
+			(row[3], row[5]), row[15] = order_sku(case), quantity
+			reimbursements.append(row)
+	header = [''] * 16
+	header[3], header[5], header[15] = 'amazon-order-id', 'sku', 'quantity-reimbursed-total'
+	write_csv(os.path.join(directory, 'reimbursements.csv'), header, reimbursements)
+
+	write_csv(os.path.join(directory, 'returns_to_fba.csv'), ['', 'order-id', 'sku', '', '', '', 'quantity'], [
+		[''] + list(order_sku(case)) + [''] * 3 + [quantity]
+		for case, quantities in sorted(RETURNS_TO_FBA.iteritems()) for quantity in quantities
+	])
+	write_csv(os.path.join(directory, 'date_range.csv'), ['', '', 'type', 'order id', 'sku', '', 'quantity'], [
+		['', '', order_type] + list(order_sku(case)) + ['', quantity]
+		for case, rows in sorted(DATE_RANGE.iteritems()) for order_type, quantity in rows
+	])
+
+
+def main():
+	directory = tempfile.mkdtemp()
+	try:
+		make_files(directory)
+		reports_data = dict((engine, run_engine(directory, engine)[2]) for engine in ('dict', 'columnar'))
+	finally:
+		shutil.rmtree(directory)
+
+	failures = []
+	for case in sorted(KEYS):
+		key = order_sku(case)
+		dict_data, columnar_data = reports_data['dict'].get(key), reports_data['columnar'].get(key)
+		if dict_data != columnar_data:
+			failures.append('{}: dict {!r} != columnar {!r}'.format(case, dict_data, columnar_data))
+		expected_reason = KEYS[case][2]
+		if expected_reason and getattr(dict_data, 'reason', None) != expected_reason:
+			failures.append('{}: reason {!r}, expected {!r}'.format(case, getattr(dict_data, 'reason', None), expected_reason))
+	if set(reports_data['dict']) != set(reports_data['columnar']):
+		failures.append('Engines have different keys')
+
+	for failure in failures:
+		print failure
+	if failures:
+		return 1
+	print 'Same reports data of both engines for {} cases'.format(len(KEYS))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,125 @@
+import csv
+import imp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+
+"""
+
+Benchmark of the debug join and the reasons check: 'dict' engine against 'columnar' one.
+Both engines run over the same synthetic csv files and the script exits with an error
+if 'reports_data' they make differs for any key.
+
+Usage: python benchmarks/columnar_reasons.py [keys]
+
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+script = imp.load_source('script_v1_4', os.path.join(BASE_DIR, 'script_v1.4.py'))
+
+DEFAULT_KEYS = 1000000
+
+
+def write_csv(file_name, rows_count, make_row):
+	with open(file_name, 'wb') as csvfile:
+		writer = csv.writer(csvfile, delimiter=',')
+		writer.writerow(make_row(None))
+		for i in xrange(rows_count):
+			writer.writerow(make_row(i))
+
+
+def make_files(directory, keys, seed=0):
+	rnd = random.Random(seed)
+	key = lambda i: ('{:03d}-{:07d}'.format(i % 1000, i), 'SKU{}_FBA'.format(i % 5000))
+	random_key = lambda: key(rnd.randint(0, int(keys * 1.1)))
+
+	def version_row(i):
+		return ['', 'order_id', 'sku'] if i is None else [''] + list(random_key()) + ['']
+
+	def reimbursements_row(i):
+		row = [''] * 16
+		if i is None:
+			row[3], row[5], row[15] = 'amazon-order-id', 'sku', 'quantity-reimbursed-total'
+		else:
+			row[3], row[5] = random_key()
+			row[15] = str(rnd.randint(0, 2))
+		return row
+
+	def returns_to_fba_row(i):
+		row = [''] * 7
+		if i is None:
+			row[1], row[2], row[6] = 'order-id', 'sku', 'quantity'
+		else:
+			row[1], row[2] = random_key()
+			row[6] = str(rnd.randint(0, 2))
+		return row
+
+	def date_range_row(i):
+		row = [''] * 7
+		if i is None:
+			row[2], row[3], row[4], row[6] = 'type', 'order id', 'sku', 'quantity'
+		else:
+			row[2] = rnd.choice(['Order', 'Order', 'Refund'])
+			row[3], row[4] = random_key()
+			row[6] = str(rnd.randint(1, 3))
+		return row
+
+	write_csv(os.path.join(directory, 'old.csv'), keys, version_row)
+	write_csv(os.path.join(directory, 'new.csv'), keys, version_row)
+	write_csv(os.path.join(directory, 'reimbursements.csv'), keys // 5, reimbursements_row)
+	write_csv(os.path.join(directory, 'returns_to_fba.csv'), keys // 5, returns_to_fba_row)
+	write_csv(os.path.join(directory, 'date_range.csv'), keys * 2, date_range_row)
+
+
+def run_engine(directory, engine):
+	comparison = script.OrderDiscrepancyComparisonScript(
+		old_version=os.path.join(directory, 'old.csv'),
+		new_version=os.path.join(directory, 'new.csv'),
+		reimbursements=os.path.join(directory, 'reimbursements.csv'),
+		returns_to_fba=os.path.join(directory, 'returns_to_fba.csv'),
+		date_range=os.path.join(directory, 'date_range.csv'),
+		engine=engine,
+	)
+	comparison._read_columns()
+	comparison._read_reports_data_from_files()
+	comparison._find_missing_data()
+
+	start = time.time()
+	comparison._get_reports_data_info_from_debug()
+	join_time = time.time() - start
+	if engine == 'columnar':
+		comparison._check_reasons_columnar()
+	else:
+		comparison._check_reasons()
+	return join_time, time.time() - start - join_time, comparison.reports_data
+
+
+def main(keys):
+	directory = tempfile.mkdtemp()
+	try:
+		make_files(directory, keys)
+		results = dict((engine, run_engine(directory, engine)) for engine in ('dict', 'columnar'))
+	finally:
+		shutil.rmtree(directory)
+
+	for engine in ('dict', 'columnar'):
+		join_time, reasons_time, reports_data = results[engine]
+		print '{:>9}: {} keys, debug join {:.3f}s, reasons {:.3f}s, total {:.3f}s'.format(
+			engine, len(reports_data), join_time, reasons_time, join_time + reasons_time)
+
+	dict_reports_data, columnar_reports_data = results['dict'][2], results['columnar'][2]
+	mismatches = [
+		order_sku for order_sku, data in dict_reports_data.iteritems() if data != columnar_reports_data[order_sku]
+	]
+	if mismatches:
+		sys.exit('Engines differ for {} keys, e.g. {}'.format(len(mismatches), mismatches[:5]))
+	print 'Same reports data for all keys'
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_KEYS)
@@ -0,0 +1,87 @@
+from collections import Counter
+import imp
+import os
+import random
+import sys
+import time
+
+
+"""
+
+Benchmark of OrderDiscrepancyComparisonScript._find_missing_data
+
+Compares the hash-indexed multiset diff with the old list based one.
+The list based diff is O(n*m), so it is only run up to LEGACY_MAX_ROWS rows,
+for bigger sizes its time is extrapolated quadratically.
+
+Usage: python benchmarks/find_missing_data.py [rows [rows ...]]
+
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+script = imp.load_source('script_v1_4', os.path.join(BASE_DIR, 'script_v1.4.py'))
+
+DEFAULT_ROWS = [10000, 100000, 1000000]
+LEGACY_MAX_ROWS = 10000
+OVERLAP = 0.9 # Share of keys which are in both versions
+
+
+def make_order_skus(rows, seed=0):
+	rnd = random.Random(seed)
+	keys = [('{:03d}-{:07d}-{:07d}'.format(rnd.randint(100, 120), i, rnd.randint(0, 9999999)),
+			 'SKU{}_FBA'.format(rnd.randint(0, 5000))) for i in xrange(rows)]
+	old = [key for key in keys if rnd.random() < OVERLAP]
+	new = [key for key in keys if rnd.random() < OVERLAP]
+	return old, new
+
+
+def legacy_find_missing_data(old_data_order_skus, new_data_order_skus):
+	# The former implementation: membership tests against plain lists
+	reports_data = {}
+	for order_sku in old_data_order_skus:
+		reports_data[order_sku] = {'status': 'FINE'}
+		if order_sku not in new_data_order_skus:
+			reports_data[order_sku]['status'] = 'MISSING'
+	for order_sku in new_data_order_skus:
+		reports_data[order_sku] = {'status': 'FINE'}
+		if order_sku not in old_data_order_skus:
+			reports_data[order_sku]['status'] = 'MISSING'
+	return reports_data
+
+
+def indexed_find_missing_data(old, new):
+	comparison = script.OrderDiscrepancyComparisonScript('old.csv', 'new.csv')
+	comparison.old_data_order_skus = Counter(old)
+	comparison.new_data_order_skus = Counter(new)
+	comparison._find_missing_data()
+	return comparison.reports_data
+
+
+def timeit(func, *args):
+	start = time.time()
+	func(*args)
+	return time.time() - start
+
+
+def main(sizes):
+	print '{:>10} {:>14} {:>14} {:>10}'.format('rows', 'list (s)', 'indexed (s)', 'speedup')
+	legacy_per_pair = None
+	for rows in sizes:
+		old, new = make_order_skus(rows)
+		indexed_time = timeit(indexed_find_missing_data, old, new)
+		if rows <= LEGACY_MAX_ROWS:
+			legacy_time = timeit(legacy_find_missing_data, old, new)
+			legacy_per_pair = legacy_time / (len(old) * len(new))
+			legacy = '{:.3f}'.format(legacy_time)
+		elif legacy_per_pair:
+			legacy_time = legacy_per_pair * len(old) * len(new)
+			legacy = '~{:.0f}'.format(legacy_time)
+		else:
+			legacy_time, legacy = None, 'skipped'
+		speedup = '{:.0f}x'.format(legacy_time / indexed_time) if legacy_time else '-'
+		print '{:>10} {:>14} {:>14.3f} {:>10}'.format(rows, legacy, indexed_time, speedup)
+
+
+if __name__ == '__main__':
+	main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
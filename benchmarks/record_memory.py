@@ -0,0 +1,75 @@
+import os
+import resource
+import subprocess
+import sys
+
+
+"""
+
+Memory benchmark of 'reports_data' records: per-key dicts against ReportRecord.
+Each representation is built in its own process and the growth of its peak RSS is reported
+(tracemalloc is not available on Python 2, so the process peak is measured instead).
+
+Usage: python benchmarks/record_memory.py [keys]
+
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from report_record import ReportRecord
+
+DEFAULT_KEYS = 1000000
+
+IS_IN = 'new version (filename: new.csv)'
+MISSING_IN = 'old version (filename: old.csv)'
+REASON = 'not in debug report'
+
+
+def peak_rss_kb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_dict_record(i):
+	data = {'status': 'MISSING', 'is_in': IS_IN, 'missing_in': MISSING_IN, 'old_count': 0, 'new_count': 1}
+	data['in_debug'] = True
+	data['order_qty'] = i % 3
+	data['refund_qty'] = i % 2
+	data['reason'] = REASON
+	data['reason_found'] = True
+	return data
+
+
+def make_report_record(i):
+	data = ReportRecord()
+	data.status, data.is_in, data.missing_in, data.old_count, data.new_count = 'MISSING', IS_IN, MISSING_IN, 0, 1
+	data.in_debug = True
+	data.order_qty = i % 3
+	data.refund_qty = i % 2
+	data.reason = REASON
+	data.reason_found = True
+	return data
+
+
+def measure(representation, keys):
+	make_record = make_dict_record if representation == 'dict' else make_report_record
+	order_skus = [('{:03d}-{:07d}'.format(i % 1000, i), 'SKU{}_FBA'.format(i % 5000)) for i in xrange(keys)]
+	before = peak_rss_kb()
+	reports_data = dict((order_sku, make_record(i)) for i, order_sku in enumerate(order_skus))
+	print peak_rss_kb() - before
+
+
+def main(keys):
+	results = {}
+	for representation in ('dict', 'record'):
+		output = subprocess.check_output([sys.executable, __file__, '--measure', representation, str(keys)])
+		results[representation] = int(output.split()[-1])
+		print '{:>7}: {} keys, peak RSS +{:.1f} MB'.format(representation, keys, results[representation] / 1024.0)
+	print 'ReportRecord uses {:.1f}x less memory'.format(float(results['dict']) / results['record'])
+
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['--measure']:
+		measure(sys.argv[2], int(sys.argv[3]))
+	else:
+		main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_KEYS)
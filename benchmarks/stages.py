@@ -0,0 +1,223 @@
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import synthetic_reports
+
+
+"""
+
+Benchmark of the stages of OrderDiscrepancyComparisonScript.run_script over synthetic reports
+(see 'synthetic_reports') of growing sizes. Each size is run in a process of its own, so its peak RSS
+is not taken from a bigger one. The stage metrics (see 'run_metrics') of every run are appended
+to a JSON lines results file with the commit and the options of the run. A stage which is slower
+than in the previous recorded run of the same size and options is reported as a regression,
+and the script exits with status 1 then.
+
+Generated reports are kept in '--data-dir' and are reused by the next runs with the same data arguments.
+
+Usage: python benchmarks/stages.py [rows [rows ...]] [--workers 4] [--engine columnar] [--output-format xlsx] ...
+	python benchmarks/stages.py 10000 100000 1000000 10000000
+
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_ROWS = [10000, 100000, 1000000]
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'compare_script_benchmark')
+
+# The results are kept with the checkout to compare the next runs with, 'benchmarks/results' is in '.gitignore'
+DEFAULT_RESULTS_FILE = os.path.join(BASE_DIR, 'benchmarks', 'results', 'stages.jsonl')
+
+# A stage is a regression if it's this many times slower than in the previous run
+DEFAULT_THRESHOLD = 1.25
+
+# Stages faster than that are not compared, their time is mostly noise
+MIN_COMPARED_SECONDS = 0.1
+
+
+def run_job(job):
+	"""
+	Run the comparison of one size and write its metrics, it's called in a process of its own
+	"""
+	sys.path.insert(0, BASE_DIR)
+	import imp
+	script = imp.load_source('script_v1_4', os.path.join(BASE_DIR, 'script_v1.4.py'))
+	paths = job['paths']
+	comparison = script.OrderDiscrepancyComparisonScript(
+		old_version=paths['old_version'],
+		new_version=paths['new_version'],
+		reimbursements=paths['reimbursements'],
+		returns_to_fba=paths['returns_to_fba'],
+		date_range=paths['date_range'],
+		output_dir=job['output_dir'],
+		metrics_file=job['metrics_file'],
+		**job['options']
+	)
+	comparison.run_script()
+
+
+def measure(rows, paths, options):
+	# Metrics of a run of one size in a new process, the output of the script is dropped
+	output_dir = tempfile.mkdtemp()
+	try:
+		job = {
+			'paths': paths,
+			'options': options,
+			'output_dir': output_dir,
+			'metrics_file': os.path.join(output_dir, 'metrics.json'),
+		}
+		with open(os.devnull, 'wb') as devnull:
+			subprocess.check_call([sys.executable, os.path.abspath(__file__), '--run-job', json.dumps(job)], stdout=devnull)
+		with open(job['metrics_file'], 'rb') as metrics_file:
+			return json.load(metrics_file)
+	finally:
+		shutil.rmtree(output_dir)
+
+
+def data_paths(data_dir, rows, data_args):
+	# Reports of these arguments, they are generated if they aren't in 'data_dir' yet
+	directory = os.path.join(data_dir, '{}_{}'.format(rows, '_'.join(
+		'{}-{}'.format(name, data_args[name]) for name in sorted(data_args))))
+	done_file = os.path.join(directory, '.done')
+	if not os.path.isfile(done_file):
+		print 'Generating {} rows reports...'.format(rows)
+		paths = synthetic_reports.make_reports(directory, rows, **data_args)
+		open(done_file, 'wb').close()
+	else:
+		paths = dict((input_name, os.path.join(directory, file_name))
+					 for input_name, file_name in synthetic_reports.FILE_NAMES.iteritems())
+	return paths
+
+
+def load_results(results_file):
+	if not os.path.isfile(results_file):
+		return []
+	with open(results_file, 'rb') as results:
+		return [json.loads(line) for line in results if line.strip()]
+
+
+def previous_result(results, result):
+	# The last recorded run of the same size, options and data
+	for previous in reversed(results):
+		if all(previous[field] == result[field] for field in ('rows', 'options', 'data', 'python')):
+			return previous
+	return None
+
+
+def regressions(previous, result, threshold):
+	"""
+	:return: A list of (stage name, previous wall time, wall time) of the stages slower than 'threshold' times
+	"""
+	if previous is None:
+		return []
+	previous_stages = dict((stage['name'], stage) for stage in previous['metrics']['stages'])
+	slower = []
+	for stage in result['metrics']['stages']:
+		previous_stage = previous_stages.get(stage['name'])
+		if previous_stage is None or previous_stage['wall_seconds'] < MIN_COMPARED_SECONDS:
+			continue
+		if stage['wall_seconds'] > previous_stage['wall_seconds'] * threshold:
+			slower.append((stage['name'], previous_stage['wall_seconds'], stage['wall_seconds']))
+	return slower
+
+
+def git_commit():
+	try:
+		with open(os.devnull, 'wb') as devnull:
+			return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stderr=devnull).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def print_result(result, previous):
+	previous_stages = dict((stage['name'], stage) for stage in previous['metrics']['stages']) if previous else {}
+	print '{} rows: {:.2f}s, peak RSS {} MB'.format(
+		result['rows'], result['metrics']['wall_seconds'], result['metrics']['peak_rss_mb'])
+	print '  {:<18} {:>9} {:>9} {:>11} {:>11} {:>11} {:>10}'.format(
+		'stage', 'wall, s', 'cpu, s', 'rows in', 'rows out', 'previous', 'change')
+	for stage in result['metrics']['stages']:
+		previous_stage = previous_stages.get(stage['name'])
+		if previous_stage and previous_stage['wall_seconds']:
+			previous_wall = '{:.3f}'.format(previous_stage['wall_seconds'])
+			change = '{:+.0%}'.format(stage['wall_seconds'] / previous_stage['wall_seconds'] - 1)
+		else:
+			previous_wall = change = '-'
+		print '  {:<18} {:>9.3f} {:>9.3f} {:>11} {:>11} {:>11} {:>10}'.format(
+			stage['name'], stage['wall_seconds'], stage['cpu_seconds'], _count(stage['rows_in']), _count(stage['rows_out']),
+			previous_wall, change)
+
+
+def _count(count):
+	return '-' if count is None else count
+
+
+def main(argv):
+	if argv[:1] == ['--run-job']:
+		return run_job(json.loads(argv[1]))
+
+	parser = argparse.ArgumentParser(description='Benchmark the stages of the comparison script')
+	parser.add_argument('rows', type=int, nargs='*', default=DEFAULT_ROWS)
+	parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='A directory to keep the generated reports in')
+	parser.add_argument('--results', default=DEFAULT_RESULTS_FILE, help='A JSON lines file to append the results to')
+	parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+	parser.add_argument('--workers', type=int)
+	parser.add_argument('--engine', default='dict')
+	parser.add_argument('--output-format', default='csv')
+	parser.add_argument('--overlap', type=float, default=0.9)
+	parser.add_argument('--duplicate-rate', type=float, default=0.02)
+	parser.add_argument('--debug-share', type=float, default=0.8)
+	parser.add_argument('--refund-share', type=float, default=0.3)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+
+	options = {'workers': args.workers, 'engine': args.engine, 'output_format': args.output_format}
+	data_args = {
+		'overlap': args.overlap,
+		'duplicate_rate': args.duplicate_rate,
+		'debug_share': args.debug_share,
+		'refund_share': args.refund_share,
+		'seed': args.seed,
+	}
+	results = load_results(args.results)
+	if not os.path.isdir(os.path.dirname(os.path.abspath(args.results))):
+		os.makedirs(os.path.dirname(os.path.abspath(args.results)))
+
+	slower = []
+	for rows in args.rows:
+		paths = data_paths(args.data_dir, rows, data_args)
+		result = {
+			'date': datetime.now().isoformat(),
+			'commit': git_commit(),
+			'python': platform.python_version(),
+			'rows': rows,
+			'options': options,
+			'data': data_args,
+			'metrics': measure(rows, paths, options),
+		}
+		previous = previous_result(results, result)
+		print_result(result, previous)
+		slower.extend((rows,) + stage for stage in regressions(previous, result, args.threshold))
+
+		with open(args.results, 'ab') as results_file:
+			results_file.write(json.dumps(result, sort_keys=True) + '\n')
+		results.append(result)
+
+	print 'Results have been appended to \'{}\''.format(args.results)
+	if slower:
+		print 'Regressions (slower than {:.2f}x of the previous run):'.format(args.threshold)
+		for rows, stage_name, previous_wall, wall in slower:
+			print '  {} rows, {}: {:.3f}s -> {:.3f}s'.format(rows, stage_name, previous_wall, wall)
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_reports
+
+
+"""
+
+Benchmark of the startup of script_v1.4.py, which dominates small comparisons fired one after another.
+Each command is run 'repeat' times in a new process and its min and median wall times are printed:
+the bare interpreter, the import of openpyxl alone, the import of the script, a '--check' dry run
+and whole comparisons of small synthetic reports (see 'synthetic_reports') with csv and xlsx output.
+
+The script has to import none of HEAVY_MODULES when it's loaded, it exits with status 1 if it does.
+
+Usage: python benchmarks/startup.py [--rows 1000] [--repeat 10]
+
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = os.path.join(BASE_DIR, 'script_v1.4.py')
+
+# Modules which are imported only when the chosen options need them
+HEAVY_MODULES = ('openpyxl', 'numpy', 'pyarrow')
+
+DEFAULT_ROWS = 1000
+
+DEFAULT_REPEAT = 10
+
+IMPORT_SCRIPT = '''
+import imp, sys
+sys.path.insert(0, {base_dir!r})
+imp.load_source('script_v1_4', {script!r})
+print ' '.join(module for module in {heavy_modules!r} if module in sys.modules)
+'''.format(base_dir=BASE_DIR, script=SCRIPT, heavy_modules=HEAVY_MODULES)
+
+
+def commands(paths, output_dir):
+	"""
+	:return: A list of (name, command) to measure
+	"""
+	inputs = [
+		'--old-version', paths['old_version'], '--new-version', paths['new_version'],
+		'--reimbursements', paths['reimbursements'], '--returns-to-fba', paths['returns_to_fba'],
+		'--date-range', paths['date_range'], '--output-dir', output_dir,
+	]
+	return [
+		('interpreter', [sys.executable, '-c', 'pass']),
+		('import openpyxl', [sys.executable, '-c', 'import openpyxl']),
+		('import script', [sys.executable, '-c', IMPORT_SCRIPT]),
+		('--check', [sys.executable, SCRIPT, '--check'] + inputs),
+		('compare, csv', [sys.executable, SCRIPT, '--output-format', 'csv'] + inputs),
+		('compare, xlsx', [sys.executable, SCRIPT, '--output-format', 'xlsx'] + inputs),
+	]
+
+
+def measure(command, repeat):
+	"""
+	:return: A tuple of (wall times, output of the last run)
+	"""
+	times = []
+	for _ in xrange(repeat):
+		start = time.time()
+		output = subprocess.check_output(command)
+		times.append(time.time() - start)
+	return times, output
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Benchmark the startup of the comparison script')
+	parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help='Number of keys of the synthetic reports')
+	parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+	args = parser.parse_args(argv)
+
+	data_dir = tempfile.mkdtemp()
+	try:
+		paths = synthetic_reports.make_reports(os.path.join(data_dir, 'reports'), args.rows)
+		output_dir = os.path.join(data_dir, 'output')
+		os.mkdir(output_dir)
+
+		print '{} rows, {} runs of each command'.format(args.rows, args.repeat)
+		print '  {:<18} {:>9} {:>11}'.format('command', 'min, s', 'median, s')
+		heavy_imported = None
+		for name, command in commands(paths, output_dir):
+			times, output = measure(command, args.repeat)
+			times.sort()
+			print '  {:<18} {:>9.3f} {:>11.3f}'.format(name, times[0], times[len(times) // 2])
+			if name == 'import script':
+				heavy_imported = output.split()
+	finally:
+		shutil.rmtree(data_dir)
+
+	if heavy_imported:
+		print 'The script imports {} when it\'s loaded'.format(', '.join(heavy_imported))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,177 @@
+import argparse
+import csv
+import os
+import random
+import sys
+
+
+"""
+
+Generator of synthetic input files of OrderDiscrepancyComparisonScript: old and new versions of the report
+and 'Reimbursements', 'ReturnsToFBA', 'DateRangeCSV' sheets of the debug report, with the columns
+of real exports. The same arguments always give the same files.
+
+Keys are made from their numbers, so the files are written row by row and none of them is kept in memory:
+	- a key is in both versions with 'overlap' probability, in one of them only otherwise
+	- a version row is written twice with 'duplicate_rate' probability
+	- a key is in DateRangeCSV with 'debug_share' probability, it has 1-3 rows there, 'refund_share' of them are refunds
+	- a key is in Reimbursements and in ReturnsToFBA with 'debug_share' / 4 probability each
+	- 'rows' / 10 more keys are in the debug report only, as real reports have orders of other periods
+
+Usage: python benchmarks/synthetic_reports.py <directory> <rows> [--overlap 0.9] [--duplicate-rate 0.02] ...
+
+"""
+
+FILE_NAMES = {
+	'old_version': 'old_version.csv',
+	'new_version': 'new_version.csv',
+	'reimbursements': 'reimbursements.csv',
+	'returns_to_fba': 'returns_to_fba.csv',
+	'date_range': 'date_range.csv',
+}
+
+VERSION_COLUMNS = ['date', 'order-id', 'sku', 'fnsku', 'asin', 'quantity', 'fulfillment-center-id']
+
+REIMBURSEMENTS_COLUMNS = [
+	'approval-date', 'reimbursement-id', 'case-id', 'amazon-order-id', 'reason', 'sku', 'fnsku', 'asin',
+	'product-name', 'condition', 'currency-unit', 'amount-per-unit', 'amount-total', 'quantity-reimbursed-cash',
+	'quantity-reimbursed-inventory', 'quantity-reimbursed-total', 'original-reimbursement-id',
+	'original-reimbursement-type',
+	]
+
+RETURNS_TO_FBA_COLUMNS = [
+	'return-date', 'order-id', 'sku', 'asin', 'fnsku', 'product-name', 'quantity', 'fulfillment-center-id',
+	'detailed-disposition', 'reason', 'status', 'license-plate-number', 'customer-comments',
+	]
+
+DATE_RANGE_COLUMNS = [
+	'date/time', 'settlement id', 'type', 'order id', 'sku', 'description', 'quantity', 'marketplace',
+	'fulfillment', 'order city', 'order state', 'order postal', 'product sales', 'shipping credits',
+	'gift wrap credits', 'promotional rebates', 'sales tax collected', 'marketplace facilitator tax',
+	'selling fees', 'fba fees', 'other transaction fees', 'other', 'total',
+	]
+
+# Share of the debug-only keys, of 'rows'
+DEBUG_ONLY_SHARE = 0.1
+
+WRITE_BATCH = 10000
+
+
+def order_sku(number):
+	# (order_id, sku) of a key number, as Amazon ids look
+	return ('{:03d}-{:07d}-{:07d}'.format(111 + number % 7, number % 9999991, number), 'SKU{}_FBA'.format(number % 5003))
+
+
+def make_reports(directory, rows, overlap=0.9, duplicate_rate=0.02, debug_share=0.8, refund_share=0.3, seed=0):
+	"""
+	Write the five input files to 'directory'
+
+	:param rows: Number of keys of the versions, each version has about 'rows' * (1 + overlap) / 2 rows
+	:param overlap: Share of the keys which are in both versions
+	:param duplicate_rate: Share of the version rows which are duplicated
+	:param debug_share: Share of the keys which are in DateRangeCSV
+	:param refund_share: Share of the refund rows of DateRangeCSV
+	:param seed: Seed of the random data, the same seed gives the same files
+	:return: A dict of the input names to the file paths
+	"""
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	paths = dict((input_name, os.path.join(directory, file_name)) for input_name, file_name in FILE_NAMES.iteritems())
+	debug_keys = xrange(int(rows * (1 + DEBUG_ONLY_SHARE)))
+
+	# Each file has a random generator of its own, so changing one file's arguments doesn't change the others
+	rnd = lambda file_number: random.Random(seed * len(FILE_NAMES) + file_number)
+
+	_write_version(paths['old_version'], xrange(rows), overlap, duplicate_rate, rnd(0), 0)
+	_write_version(paths['new_version'], xrange(rows), overlap, duplicate_rate, rnd(1), 1)
+	_write_file(paths['reimbursements'], REIMBURSEMENTS_COLUMNS, _reimbursements_rows(debug_keys, debug_share / 4, rnd(2)))
+	_write_file(paths['returns_to_fba'], RETURNS_TO_FBA_COLUMNS, _returns_to_fba_rows(debug_keys, debug_share / 4, rnd(3)))
+	_write_file(paths['date_range'], DATE_RANGE_COLUMNS, _date_range_rows(debug_keys, debug_share, refund_share, rnd(4)))
+	return paths
+
+
+def _spread(number):
+	# A number in [0, 1) which looks random for successive key numbers (multiplicative hashing)
+	return (number * 2654435761 % 4294967296) / 4294967296.0
+
+
+def _write_file(path, columns, rows):
+	with open(path, 'wb') as csvfile:
+		writer = csv.writer(csvfile, delimiter=',')
+		writer.writerow(columns)
+		batch = []
+		for row in rows:
+			batch.append(row)
+			if len(batch) >= WRITE_BATCH:
+				writer.writerows(batch)
+				batch = []
+		writer.writerows(batch)
+
+
+def _write_version(path, keys, overlap, duplicate_rate, rnd, version_number):
+	# Whether a key is in both versions depends on its number only, not on 'rnd',
+	# so the versions agree on which keys they share. A key of one version is in the old or the new one by parity
+	def rows():
+		for number in keys:
+			if _spread(number) >= overlap and number % 2 != version_number:
+				continue
+			order_id, sku = order_sku(number)
+			row = ['2018-01-{:02d}'.format(1 + number % 28), order_id, sku, 'X00{:07d}'.format(number % 5003),
+				   'B0{:08d}'.format(number % 5003), str(rnd.randint(1, 3)), 'PHX{}'.format(number % 7)]
+			yield row
+			if rnd.random() < duplicate_rate:
+				yield row
+	_write_file(path, VERSION_COLUMNS, rows())
+
+
+def _reimbursements_rows(keys, share, rnd):
+	for number in keys:
+		if rnd.random() >= share:
+			continue
+		order_id, sku = order_sku(number)
+		quantity = rnd.randint(0, 2)
+		yield ['2018-02-01T10:00:00+00:00', str(5000000000 + number), '', order_id, 'CustomerReturn', sku,
+			   'X00{:07d}'.format(number % 5003), 'B0{:08d}'.format(number % 5003), 'Product {}'.format(number % 5003),
+			   'SellableItem', 'USD', '9.99', '{:.2f}'.format(9.99 * quantity), '0', str(quantity), str(quantity), '', '']
+
+
+def _returns_to_fba_rows(keys, share, rnd):
+	for number in keys:
+		if rnd.random() >= share:
+			continue
+		order_id, sku = order_sku(number)
+		yield ['2018-02-01T10:00:00+00:00', order_id, sku, 'B0{:08d}'.format(number % 5003), 'X00{:07d}'.format(number % 5003),
+			   'Product {}, pack of {}'.format(number % 5003, 1 + number % 4), str(rnd.randint(0, 2)), 'PHX{}'.format(number % 7),
+			   'SELLABLE', 'UNWANTED_ITEM', 'Unit returned to inventory', 'LPN{}'.format(number), '']
+
+
+def _date_range_rows(keys, share, refund_share, rnd):
+	for number in keys:
+		if rnd.random() >= share:
+			continue
+		order_id, sku = order_sku(number)
+		for _ in xrange(rnd.randint(1, 3)):
+			order_condition = 'Refund' if rnd.random() < refund_share else 'Order'
+			yield ['Jan {}, 2018 12:00:00 AM PST'.format(1 + number % 28), '8470918451', order_condition, order_id, sku,
+				   'Product {}, pack of {}'.format(number % 5003, 1 + number % 4), str(rnd.randint(1, 3)), 'amazon.com',
+				   'Amazon', 'SEATTLE', 'WA', '98101', '19.99', '0', '0', '0', '1.75', '-1.75', '-3', '-3.19', '0', '0', '13.8']
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(description='Write synthetic input files of the comparison script')
+	parser.add_argument('directory')
+	parser.add_argument('rows', type=int)
+	parser.add_argument('--overlap', type=float, default=0.9)
+	parser.add_argument('--duplicate-rate', type=float, default=0.02)
+	parser.add_argument('--debug-share', type=float, default=0.8)
+	parser.add_argument('--refund-share', type=float, default=0.3)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+	paths = make_reports(args.directory, args.rows, args.overlap, args.duplicate_rate,
+						 args.debug_share, args.refund_share, args.seed)
+	for input_name in sorted(paths):
+		print '{:<15} {}'.format(input_name, paths[input_name])
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,132 @@
+from itertools import izip
+
+from report_record import ReportRecord
+
+# NumPy is imported by 'require_numpy' when the engine is used, as it takes longer to import than the whole script
+numpy = None
+
+
+"""
+
+Columnar engine for OrderDiscrepancyComparisonScript.
+(order_id, sku) keys of 'reports_data' are factorized into integer codes, the debug sheets
+are joined into quantity columns by these codes and each reason rule is a vectorized NumPy mask.
+The first matching rule gives the reason of a key, the same as the rules of 'reason_rules'
+registry do. Only the keys found in debug are written back to 'reports_data'.
+
+Needs NumPy to be installed.
+
+"""
+
+# Reason keys in the order the rules are checked
+REASONS_PRIORITY = ['not_in_debug', 'refund_without_order', 'refunds_qty_greater_than_orders', 'should_be_in_report']
+
+NO_REASON = -1
+
+QTY_COLUMNS = ('order_qty', 'refund_qty', 'reimbursed_qty', 'returned_qty')
+
+
+def require_numpy():
+	global numpy
+	if numpy is None:
+		try:
+			import numpy
+		except ImportError:
+			raise ImportError('Columnar engine needs numpy, install it or use the \'dict\' engine')
+
+
+def require_known_rules(rules):
+	# Masks are written for the built-in rules only, registered ones have to be checked by the 'dict' engine
+	reasons = [rule.reason for rule in sorted(rules, key=lambda rule: rule.priority)]
+	if reasons != REASONS_PRIORITY:
+		raise ValueError('Columnar engine knows only these reason rules: {}, use the \'dict\' engine for {}'.format(
+			', '.join(REASONS_PRIORITY), ', '.join(reasons)))
+
+
+
+class ColumnarReports(object):
+	"""
+	Column-wise debug info of 'reports_data' keys.
+	Quantities are lists while the debug sheets are joined (None means there were no such records)
+	and NumPy arrays after 'finish_join()'.
+
+	:param reports_data: 'reports_data' dict of OrderDiscrepancyComparisonScript
+	"""
+
+	def __init__(self, reports_data):
+		require_numpy()
+		# Code of a key is its position in the columns, dict is not changed in between,
+		# so its keys and values are in the same order
+		self.keys = reports_data.keys()
+		self.records = reports_data.values()
+		self.codes = dict(izip(self.keys, xrange(len(self.keys))))
+
+		size = len(self.keys)
+		self.in_debug = [False] * size
+		self.order_qty = [None] * size
+		self.refund_qty = [None] * size
+		self.reimbursed_qty = [None] * size
+		self.returned_qty = [None] * size
+
+	def add_debug_qty(self, code, qty_name, qty):
+		self.in_debug[code] = True
+		if qty_name:
+			qty_column = getattr(self, qty_name)
+			qty_column[code] = (qty_column[code] or 0) + qty
+
+	def finish_join(self):
+		"""
+		Put the debug info of the joined keys to their 'reports_data' records and turn the columns into arrays
+		"""
+		records = self.records
+		self.in_debug = numpy.array(self.in_debug, dtype=bool)
+		for code in numpy.flatnonzero(self.in_debug).tolist():
+			records[code].in_debug = True
+
+		for qty_name in QTY_COLUMNS:
+			qty_column = getattr(self, qty_name)
+			for code, qty in enumerate(qty_column):
+				if qty is not None:
+					setattr(records[code], qty_name, qty)
+			setattr(self, qty_name, numpy.array([qty or 0 for qty in qty_column], dtype=numpy.int64))
+
+	def reason_masks(self):
+		"""
+		Masks of the reason rules in the order of 'REASONS_PRIORITY'
+		"""
+		order_qty, refund_qty = self.order_qty, self.refund_qty
+		not_refunded_back = self.reimbursed_qty + self.returned_qty
+
+		not_in_debug = ~self.in_debug
+		refund_without_order = (order_qty == 0) & (refund_qty > 0)
+		# In new logic refund qty cannot be greater than orders, so refund qty is the same as order qty there
+		refunds_qty_greater_than_orders = (order_qty != 0) & (order_qty < refund_qty) & (order_qty - not_refunded_back <= 0)
+		should_be_in_report = (refund_qty - not_refunded_back > 0) & (order_qty != 0)
+
+		return [not_in_debug, refund_without_order, refunds_qty_greater_than_orders, should_be_in_report]
+
+	def reason_codes(self):
+		"""
+		Index of the first matching reason in 'REASONS_PRIORITY' for each key or NO_REASON
+		"""
+		return numpy.select(self.reason_masks(), range(len(REASONS_PRIORITY)), default=NO_REASON)
+
+	def check_reasons(self, reasons):
+		"""
+		Find the reasons of all the keys and put them to their 'reports_data' records
+		the same way as the rules of 'reason_rules' registry do
+
+		:param reasons: Reasons descriptions dict of OrderDiscrepancyComparisonScript
+		:return: Number of keys which reason is found
+		"""
+		reason_codes = self.reason_codes()
+		# Codes of the reasons in records table
+		record_reason_codes = [ReportRecord.reason_code_of(reasons[reason]) for reason in REASONS_PRIORITY]
+
+		found = numpy.flatnonzero(reason_codes != NO_REASON)
+		records = self.records
+		for code, reason_code in izip(found.tolist(), reason_codes[found].tolist()):
+			data = records[code]
+			data.reason_code = record_reason_codes[reason_code]
+			data.reason_found = True
+		return len(found)
@@ -0,0 +1,21 @@
+import imp
+import os
+
+
+"""
+
+Entry point of the installed 'order-discrepancy-compare' command (see 'setup.py').
+OrderDiscrepancyComparisonScript is in 'script_v1.4.py', which cannot be imported by its name,
+so it's loaded from the file next to this module and its 'main' is run. It's loaded as a module
+of the package of this one, so its imports find the modules of the package.
+
+"""
+
+SCRIPT_FILE = 'script_v1.4.py'
+
+
+def main():
+	package = __name__.rpartition('.')[0]
+	module_name = '{}.script_v1_4'.format(package) if package else 'script_v1_4'
+	script = imp.load_source(module_name, os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPT_FILE))
+	return script.main()
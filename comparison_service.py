@@ -0,0 +1,209 @@
+from collections import OrderedDict
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import threading
+import time
+
+import parallel_reader
+import xlsx_reader
+from report_schema import DEBUG_SHEETS, job_arguments
+
+
+"""
+
+Local HTTP service running comparisons of OrderDiscrepancyComparisonScript in one long-lived process.
+Parsed debug sheets are kept in memory between the requests, so a comparison against a debug report
+which has been used already doesn't parse it again. The least recently used sheets are dropped
+when they take more than 'max_memory'. A sheet file is known by its path, size and mtime,
+so a changed file is parsed again. Requests are handled in threads of their own.
+
+	python script_v1.4.py --serve [port]
+
+	POST /compare  {"old_version": "51.csv", "new_version": "26.csv", "debug_report": "debug.xlsx"}
+		-> {"output_file": "...", "seconds": 0.4}
+	GET /status -> parsed sheets in memory
+
+A comparison takes the OrderDiscrepancyComparisonScript arguments as in a batch manifest job (see 'batch_runner.read_batch_manifest'),
+relative paths are relative to the directory the service runs in. The output file is put to the directory
+of the old version if 'output_dir' is not given. Bad arguments get a 400 response with the error.
+
+"""
+
+DEFAULT_PORT = 8765
+
+# Max memory of the parsed sheets kept between the requests
+DEFAULT_MAX_MEMORY = 1024 * 1024 * 1024
+
+# Memory a key of a parsed sheet takes: the key tuple, its strings and the quantities dict
+PARSED_KEY_MEMORY = 512
+
+
+
+class DebugIndexes(object):
+	"""
+	Parsed debug sheets (parallel_reader partial results) by their files, with LRU eviction by memory.
+	A sheet being parsed for a request is waited for by the other requests of it, so it's parsed once.
+
+	:param max_memory: Max memory of the sheets in bytes, the sheet used last is kept anyway
+	"""
+
+	def __init__(self, max_memory=None):
+		self.max_memory = max_memory or DEFAULT_MAX_MEMORY
+		self.entries = OrderedDict() # {(sheet, path, size, mtime): (partials, memory)}
+		self.lock = threading.Lock()
+		self.parsing = {} # Locks of the sheets being parsed by their keys
+		self.hits = self.misses = 0
+
+	def get(self, sheet, path):
+		"""
+		:return: Partial results of the parsed sheet, it's parsed if it isn't in memory
+		"""
+		stat = os.stat(path)
+		key = (sheet, os.path.abspath(path), stat.st_size, stat.st_mtime)
+		with self.lock:
+			partials = self._take(key)
+			if partials is not None:
+				self.hits += 1
+				return partials
+			sheet_lock = self.parsing.setdefault(key, threading.Lock())
+
+		with sheet_lock:
+			with self.lock:
+				partials = self._take(key) # It's been parsed by another request meanwhile
+				if partials is not None:
+					self.hits += 1
+					return partials
+
+			try:
+				partials = parallel_reader.ParallelReader(None).submit(sheet, path).get()
+			finally:
+				with self.lock:
+					self.parsing.pop(key, None)
+			memory = sum(len(partial) for partial in partials) * PARSED_KEY_MEMORY
+			with self.lock:
+				self.misses += 1
+				self.entries[key] = (partials, memory)
+				self._evict()
+		return partials
+
+	def _take(self, key):
+		# Partials of the key marked as used last, or None
+		entry = self.entries.pop(key, None)
+		if entry is None:
+			return None
+		self.entries[key] = entry
+		return entry[0]
+
+	def _evict(self):
+		# Headers of a workbook are dropped with the last of its sheets, so they don't outlive them
+		memory = sum(entry_memory for _, entry_memory in self.entries.itervalues())
+		while memory > self.max_memory and len(self.entries) > 1:
+			(_, path, size, mtime), (_, entry_memory) = self.entries.popitem(last=False)
+			memory -= entry_memory
+			if xlsx_reader.is_workbook(path) and not any(key[1:] == (path, size, mtime) for key in self.entries):
+				xlsx_reader.forget_headers(path, size, mtime)
+
+	def status(self):
+		with self.lock:
+			sheets = [
+				{'sheet': sheet, 'path': path, 'memory': memory}
+				for (sheet, path, _, _), (_, memory) in self.entries.iteritems()
+			]
+			return {
+				'sheets': sheets,
+				'memory': sum(sheet['memory'] for sheet in sheets),
+				'max_memory': self.max_memory,
+				'hits': self.hits,
+				'misses': self.misses,
+			}
+
+
+
+class ComparisonServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""
+	:param address: A (host, port) to listen on
+	:param comparison_class: OrderDiscrepancyComparisonScript
+	:param max_memory: Max memory of the parsed debug sheets
+	"""
+
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, comparison_class, max_memory=None):
+		BaseHTTPServer.HTTPServer.__init__(self, address, ComparisonRequestHandler)
+		self.comparison_class = comparison_class
+		self.debug_indexes = DebugIndexes(max_memory)
+
+	def compare(self, job):
+		"""
+		Run a comparison of the job arguments with the parsed debug sheets
+		:return: A dict of the output file and the comparison time
+		"""
+		start = time.time()
+		arguments = job_arguments(job)
+		if 'debug_aggregates' in arguments:
+			raise ValueError('\'debug_aggregates\' cannot be given to the service, its debug sheets are parsed by it')
+
+		# Sheets of the debug report workbook are taken as the sheet files,
+		# so the workbook is not opened again when its sheets are parsed already
+		debug_report = arguments.pop('debug_report', None)
+		for sheet in DEBUG_SHEETS:
+			arguments[sheet] = arguments.get(sheet) or debug_report
+		arguments.setdefault('output_dir', os.path.dirname(os.path.abspath(arguments.get('old_version', ''))))
+		arguments['debug_aggregates'] = dict(
+			(sheet, self.debug_indexes.get(sheet, arguments[sheet])) for sheet in DEBUG_SHEETS if arguments[sheet]
+		)
+
+		comparison = self.comparison_class(**arguments)
+		comparison.run_script()
+		return {'output_file': comparison.output_file_name, 'seconds': round(time.time() - start, 3)}
+
+
+
+class ComparisonRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path != '/status':
+			return self._send_json(404, {'error': 'Unknown path {}, use GET /status or POST /compare'.format(self.path)})
+		self._send_json(200, self.server.debug_indexes.status())
+
+	def do_POST(self):
+		if self.path != '/compare':
+			return self._send_json(404, {'error': 'Unknown path {}, use GET /status or POST /compare'.format(self.path)})
+		try:
+			job = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+			if not isinstance(job, dict):
+				raise ValueError('A comparison has to be a JSON object of its arguments')
+			result = self.server.compare(job)
+		except (ValueError, TypeError, EOFError, IOError, OSError) as error:
+			# Bad arguments or input files of the request
+			return self._send_json(400, {'error': '{}: {}'.format(type(error).__name__, error)})
+		except Exception as error:
+			return self._send_json(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+		self._send_json(200, result)
+
+	def _send_json(self, status, data):
+		body = json.dumps(data)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+
+def serve(comparison_class, port=None, host='127.0.0.1', max_memory=None):
+	"""
+	Run the service until it's interrupted. It listens on the local host only by default,
+	as it reads and writes any files the user of the service can
+	"""
+	server = ComparisonServer((host, port or DEFAULT_PORT), comparison_class, max_memory)
+	print 'Comparison service is listening on http://{}:{}'.format(*server.server_address)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
@@ -0,0 +1,64 @@
+from itertools import imap
+from operator import itemgetter
+import csv
+
+
+"""
+
+Rows of the input csv files of OrderDiscrepancyComparisonScript parsed by csv.reader, a row is a tuple
+of the columns resolved by report_schema (e.g. 3, 5 and 15 of Reimbursements) in the order of the schema:
+
+	for order_id, sku, quantity in scan_rows(csvfile, (3, 4, 6)):
+		...
+
+Every field of a line is parsed by csv.reader, the columns are only picked from its row. A memory-mapped scanner
+making strings of the needed fields only is not faster than csv.reader in Python 2 on the exports of the debug report,
+which have quoted fields with commas (dates, product names) before and between the needed columns.
+
+A byte range of a file can be read, so a file can be parsed by several processes (see parallel_reader).
+Ranges are cut at new lines, so a file must not have new lines inside quoted fields to be split.
+Lines must have all the requested columns, as with csv.reader.
+
+"""
+
+
+def scan_rows(csvfile, columns, start=0, end=None):
+	"""
+	Rows of a csv file which start in [start, end) byte range, column titles are not skipped
+
+	:param csvfile: A file opened in binary mode
+	:param columns: Indexes of the columns to get, a row is a tuple of their values in this order
+	:param start: Byte offset to start at, the line it's in the middle of belongs to the previous range
+	:param end: Byte offset to stop at, the end of the file by default
+	:return: An iterator of rows
+	"""
+	return imap(_tuple_getter(tuple(columns)), csv.reader(_range_lines(csvfile, start, end), delimiter=','))
+
+
+def _range_lines(csvfile, start, end):
+	# Lines which start in [start, end), the line 'end' is in the middle of belongs to this range
+	if start:
+		csvfile.seek(start - 1)
+		csvfile.readline()
+	else:
+		csvfile.seek(0)
+	if end is None:
+		return csvfile
+	return _lines_before(csvfile, end)
+
+
+def _lines_before(csvfile, end):
+	position = csvfile.tell()
+	for line in iter(csvfile.readline, ''):
+		if position >= end:
+			return
+		yield line
+		position += len(line)
+
+
+def _tuple_getter(indexes):
+	# itemgetter of one index returns the item, not a tuple
+	if len(indexes) == 1:
+		index = indexes[0]
+		return lambda row: (row[index],)
+	return itemgetter(*indexes)
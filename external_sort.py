@@ -0,0 +1,109 @@
+from itertools import islice
+import cPickle
+import heapq
+import tempfile
+
+
+"""
+
+External sort of the output rows of OrderDiscrepancyComparisonScript which don't fit into memory.
+Rows are sorted in runs which are pickled to temporary files, the runs are merged lazily,
+so sorted rows are produced one by one:
+
+	for row in external_sort(rows, key, 1000000, reverse=True):
+		...
+
+Runs sorted elsewhere (e.g. the partitions of an out-of-core run) are written by 'write_run'
+and merged by 'merge_runs' the same way.
+
+"""
+
+
+
+class _Descending(object):
+	"""
+	Sort key wrapper which reverses the order of the key it wraps
+	"""
+	__slots__ = ('key',)
+
+	def __init__(self, key):
+		self.key = key
+
+	def __lt__(self, other):
+		return other.key < self.key
+
+	def __eq__(self, other):
+		return self.key == other.key
+
+
+
+def external_sort(rows, key, run_size, reverse=False):
+	"""
+	Sort rows keeping not more than 'run_size' of them in memory.
+	Rows are sorted in runs of 'run_size', each run is pickled to a temporary file
+	and the runs are merged lazily, so sorted rows are produced one by one.
+	The sort is stable as well as 'sorted()'.
+
+	:param rows: An iterable of rows to sort
+	:param key: A function to get the sort key of a row
+	:param run_size: Number of rows in one run
+	:param reverse: Sort in descending order
+	"""
+	rows = iter(rows)
+	run_files = []
+	try:
+		while True:
+			run = list(islice(rows, run_size))
+			if not run:
+				break
+			run.sort(key=key, reverse=reverse)
+			run_files.append(_spill_run(run))
+			del run
+
+		for row in merge_runs(run_files, key, reverse):
+			yield row
+	finally:
+		for run_file in run_files:
+			run_file.close()
+
+
+
+def _spill_run(run):
+	# Pickle sorted rows to a temporary file to merge them later
+	run_file = tempfile.TemporaryFile()
+	write_run(run, run_file)
+	run_file.seek(0)
+	return run_file
+
+
+def write_run(run, run_file):
+	# Sorted rows of a run are pickled one by one, so 'merge_runs' loads them one by one
+	for row in run:
+		cPickle.dump(row, run_file, cPickle.HIGHEST_PROTOCOL)
+
+
+
+def merge_runs(run_files, key, reverse=False):
+	"""
+	Merge sorted runs lazily, rows of equal keys are taken in the order of the runs
+	:param run_files: Files of the runs written by 'write_run' and read from the beginning, the caller closes them
+	"""
+	# Run number breaks ties between equal keys, so rows are never compared
+	wrap_key = _Descending if reverse else (lambda row_key: row_key)
+	runs = [
+		_load_run(run_file, run_number, lambda row: wrap_key(key(row)))
+		for run_number, run_file in enumerate(run_files)
+	]
+	for _, _, row in heapq.merge(*runs):
+		yield row
+
+
+
+def _load_run(run_file, run_number, key):
+	# Load pickled rows of one run as (key, run_number, row) tuples to merge them
+	while True:
+		try:
+			row = cPickle.load(run_file)
+		except EOFError:
+			return
+		yield key(row), run_number, row
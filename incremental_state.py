@@ -0,0 +1,66 @@
+import marshal
+import os
+import tempfile
+
+from report_record import ReportRecord
+
+
+"""
+
+Saved state of a comparison run for incremental re-runs of OrderDiscrepancyComparisonScript.
+The state keeps the parsed data of all five input files (as parallel_reader merges them)
+and the values of every 'reports_data' record, so a re-run reads only the changed input file
+and recomputes only the keys whose parsed data has changed.
+
+"""
+
+# Record fields kept in the state, in order of the saved tuples
+RECORD_FIELDS = (
+	'status', 'old_count', 'new_count', 'in_debug', 'order_qty', 'refund_qty', 'returned_qty', 'reimbursed_qty',
+	'reason', 'reason_found',
+	)
+
+
+def save_state(state_file, parsed, reports_data):
+	"""
+	:param state_file: A file to save the state to, it's replaced at once
+	:param parsed: A dict of input name ('old_version', 'new_version' or a debug sheet) to its parsed data
+	:param reports_data: 'reports_data' dict of OrderDiscrepancyComparisonScript
+	"""
+	state = {
+		'parsed': parsed,
+		'records': dict((order_sku, record_values(data)) for order_sku, data in reports_data.iteritems()),
+	}
+	state_dir = os.path.dirname(os.path.abspath(state_file))
+	with tempfile.NamedTemporaryFile(dir=state_dir, delete=False) as saved:
+		marshal.dump(state, saved.file)
+	os.rename(saved.name, state_file)
+
+
+def load_state(state_file):
+	with open(state_file, 'rb') as saved:
+		return marshal.load(saved)
+
+
+def record_values(data):
+	return tuple(getattr(data, field, None) for field in RECORD_FIELDS)
+
+
+def restore_record(values):
+	"""
+	Make a ReportRecord of saved values, version labels ('is_in', 'missing_in') are not saved
+	"""
+	data = ReportRecord()
+	for field, value in zip(RECORD_FIELDS, values):
+		if value is not None:
+			setattr(data, field, value)
+	return data
+
+
+def changed_keys(before, after):
+	"""
+	Keys which parsed data differs between two revisions of a file, including added and removed ones
+	"""
+	changed = set(order_sku for order_sku, value in after.iteritems() if before.get(order_sku) != value)
+	changed.update(order_sku for order_sku in before if order_sku not in after)
+	return changed
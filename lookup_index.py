@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import tempfile
+
+
+"""
+
+Persistent index of the parsed input files of OrderDiscrepancyComparisonScript for point lookups,
+to explain one (order_id, sku) without a full comparison run. It's a SQLite database with a row
+per key of the versions: its rows count in each version and its debug quantities summed over
+the debug sheets. A lookup is a primary key probe, so it takes milliseconds whatever the size
+of the reports is. The paths of the indexed input files are kept in it as well.
+
+"""
+
+# Debug quantities columns of the keys table, NULL is a quantity which is not in the debug report
+QUANTITY_COLUMNS = ('order_qty', 'refund_qty', 'returned_qty', 'reimbursed_qty')
+
+_CREATE_TABLES = [
+	'CREATE TABLE inputs (name TEXT PRIMARY KEY, path TEXT)',
+	'CREATE TABLE keys (order_id TEXT, sku TEXT, old_count INTEGER, new_count INTEGER, in_debug INTEGER, '
+	'{}, PRIMARY KEY (order_id, sku))'.format(', '.join('{} INTEGER'.format(column) for column in QUANTITY_COLUMNS)),
+	]
+
+
+def save_index(index_file, inputs, old_counts, new_counts, debug_sheets):
+	"""
+	Write the index, it's written to a temporary file which replaces 'index_file' at once
+
+	:param inputs: A dict of the input names to the paths of the indexed files
+	:param old_counts: Rows counts of the keys of the old version
+	:param new_counts: Rows counts of the keys of the new version
+	:param debug_sheets: Parsed debug sheets, dicts of (order_id, sku) to a dict of their quantities
+	"""
+	index_dir = os.path.dirname(os.path.abspath(index_file))
+	temp_fd, temp_file = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+	os.close(temp_fd)
+	try:
+		connection = sqlite3.connect(temp_file)
+		connection.text_factory = str
+		try:
+			# A half written index is never used, so it doesn't need a journal
+			connection.execute('PRAGMA journal_mode = OFF')
+			connection.execute('PRAGMA synchronous = OFF')
+			for create_table in _CREATE_TABLES:
+				connection.execute(create_table)
+			connection.executemany('INSERT INTO inputs VALUES (?, ?)', inputs.iteritems())
+			connection.executemany(
+				'INSERT INTO keys VALUES (?, ?, ?, ?, ?, {})'.format(', '.join('?' * len(QUANTITY_COLUMNS))),
+				_key_rows(old_counts, new_counts, debug_sheets))
+			connection.commit()
+		finally:
+			connection.close()
+		os.rename(temp_file, index_file)
+	except:
+		os.remove(temp_file)
+		raise
+
+
+def _key_rows(old_counts, new_counts, debug_sheets):
+	# Keys are inserted in order of the primary key, so its b-tree is appended to, not split
+	for order_sku in sorted(set(old_counts).union(new_counts)):
+		quantities = dict.fromkeys(QUANTITY_COLUMNS)
+		in_debug = False
+		for debug_sheet in debug_sheets:
+			qtys = debug_sheet.get(order_sku)
+			if qtys is not None:
+				in_debug = True
+				quantities.update(qtys)
+		yield order_sku + (old_counts.get(order_sku, 0), new_counts.get(order_sku, 0), in_debug) + tuple(
+			quantities[column] for column in QUANTITY_COLUMNS)
+
+
+
+class LookupIndex(object):
+	"""
+	:param index_file: An index written by 'save_index'
+	"""
+
+	def __init__(self, index_file):
+		if not os.path.isfile(index_file):
+			raise IOError('There is no lookup index \'{}\', build it first'.format(index_file))
+		self.connection = sqlite3.connect(index_file)
+		self.connection.text_factory = str
+
+	def inputs(self):
+		"""
+		:return: A dict of the input names to the paths of the indexed files
+		"""
+		return dict(self.connection.execute('SELECT name, path FROM inputs'))
+
+	def get(self, order_id, sku):
+		"""
+		:return: A tuple of (old rows count, new rows count, in debug, quantities dict without absent ones)
+			or None if the key is in neither version
+		"""
+		row = self.connection.execute(
+			'SELECT old_count, new_count, in_debug, {} FROM keys WHERE order_id = ? AND sku = ?'.format(
+				', '.join(QUANTITY_COLUMNS)), (order_id, sku)).fetchone()
+		if row is None:
+			return None
+		old_count, new_count, in_debug = row[:3]
+		quantities = dict((column, qty) for column, qty in zip(QUANTITY_COLUMNS, row[3:]) if qty is not None)
+		return old_count, new_count, bool(in_debug), quantities
+
+	def close(self):
+		self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+import csv
+import imp
+import json
+
+
+"""
+
+Writers of the comparison result.
+Each writer gets rows one by one and streams them to its file,
+so none of them keeps the whole result in memory. Writers import the libraries
+they need (openpyxl, pyarrow) when they are made, so a run of another format doesn't load them.
+
+"""
+
+
+class OutputWriter(object):
+	"""
+	Base class of the result writers. Use it as a context manager:
+
+		with CsvOutputWriter('result.csv', columns) as writer:
+			writer.write_row(row)
+
+	:param file_name: A name of the output file without extension
+	:param columns: A list of (title, width) tuples of the output columns
+	"""
+
+	extension = None
+
+	# A module the writer imports when it's made
+	dependency = None
+
+	def __init__(self, file_name, columns):
+		self.file_name = '{}.{}'.format(file_name, self.extension)
+		self.columns = columns
+
+	def __enter__(self):
+		self.open()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def open(self):
+		raise NotImplementedError
+
+	def write_row(self, row):
+		raise NotImplementedError
+
+	def write_sheet(self, title, columns, rows):
+		"""
+		Write a small extra table (e.g. run metrics) next to the result, only workbook formats have a place for it
+		"""
+		raise NotImplementedError('{} output has no extra sheets'.format(self.extension))
+
+	def close(self):
+		raise NotImplementedError
+
+	@classmethod
+	def check_dependency(cls):
+		"""
+		Make sure the module of the writer is installed without importing it, e.g. for a dry run
+		"""
+		if cls.dependency:
+			try:
+				imp.find_module(cls.dependency)
+			except ImportError:
+				raise ImportError(cls.missing_dependency_message())
+
+	@classmethod
+	def missing_dependency_message(cls):
+		return '{} output needs {}, install it or choose another output format'.format(
+			cls.extension.capitalize(), cls.dependency)
+
+
+
+class XlsxOutputWriter(OutputWriter):
+
+	extension = 'xlsx'
+	dependency = 'openpyxl'
+
+	def __init__(self, file_name, columns):
+		try:
+			from openpyxl import Workbook
+		except ImportError:
+			raise ImportError(self.missing_dependency_message())
+		self.workbook_class = Workbook
+		super(XlsxOutputWriter, self).__init__(file_name, columns)
+
+	def open(self):
+		# Write-only workbook streams rows to the file as they are appended (with lxml if it's installed)
+		self.workbook = self.workbook_class(write_only=True)
+		self.sheet = self.workbook.create_sheet('Auto Output')
+
+		self._set_widths(self.sheet, self.columns)
+		self.sheet.append([title for title, width in self.columns])
+
+	def write_row(self, row):
+		self.sheet.append(row)
+
+	def write_sheet(self, title, columns, rows):
+		sheet = self.workbook.create_sheet(title)
+		self._set_widths(sheet, columns)
+		sheet.append([column_title for column_title, width in columns])
+		for row in rows:
+			sheet.append(row)
+
+	@staticmethod
+	def _set_widths(sheet, columns):
+		# Column widths have to be set before any row is appended
+		for column_number, (title, width) in enumerate(columns):
+			sheet.column_dimensions[chr(ord('A') + column_number)].width = width
+
+	def close(self):
+		self.workbook.save(self.file_name)
+
+
+
+class CsvOutputWriter(OutputWriter):
+
+	extension = 'csv'
+
+	def open(self):
+		self.file = open(self.file_name, 'wb')
+		self.writer = csv.writer(self.file, delimiter=',')
+		self.writer.writerow([title for title, width in self.columns])
+
+	def write_row(self, row):
+		self.writer.writerow(row)
+
+	def close(self):
+		self.file.close()
+
+
+
+class JsonLinesOutputWriter(OutputWriter):
+	"""
+	Writes each row as a JSON object keyed by column titles, one object per line
+	"""
+
+	extension = 'jsonl'
+
+	def open(self):
+		self.file = open(self.file_name, 'wb')
+		self.titles = [title for title, width in self.columns]
+
+	def write_row(self, row):
+		self.file.write(json.dumps(OrderedDict(zip(self.titles, row))))
+		self.file.write('\n')
+
+	def close(self):
+		self.file.close()
+
+
+
+class ParquetOutputWriter(OutputWriter):
+	"""
+	Writes rows to a Parquet file in row groups of 'batch_size' rows, all columns are strings.
+	Needs pyarrow to be installed.
+	"""
+
+	extension = 'parquet'
+	dependency = 'pyarrow'
+	batch_size = 65536
+
+	def __init__(self, file_name, columns):
+		try:
+			import pyarrow
+			import pyarrow.parquet
+		except ImportError:
+			raise ImportError(self.missing_dependency_message())
+		self.pyarrow = pyarrow
+		super(ParquetOutputWriter, self).__init__(file_name, columns)
+
+	def open(self):
+		pa = self.pyarrow
+		self.titles = [title for title, width in self.columns]
+		self.schema = pa.schema([pa.field(title, pa.string()) for title in self.titles])
+		self.writer = pa.parquet.ParquetWriter(self.file_name, self.schema)
+		self.batch = []
+
+	def write_row(self, row):
+		self.batch.append(row)
+		if len(self.batch) >= self.batch_size:
+			self._write_batch()
+
+	def close(self):
+		if self.batch:
+			self._write_batch()
+		self.writer.close()
+
+	def _write_batch(self):
+		pa = self.pyarrow
+		arrays = [pa.array([row[i] for row in self.batch], type=pa.string()) for i in range(len(self.titles))]
+		self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+		self.batch = []
+
+
+
+# Output formats which can be chosen for a run
+OUTPUT_WRITERS = {
+	'xlsx': XlsxOutputWriter,
+	'csv': CsvOutputWriter,
+	'jsonl': JsonLinesOutputWriter,
+	'parquet': ParquetOutputWriter,
+}
+
+
+def get_output_writer(output_format):
+	try:
+		return OUTPUT_WRITERS[output_format]
+	except KeyError:
+		raise ValueError('Unknown output format \'{}\'. Choose one of these: {}'.format(
+			output_format, ', '.join(sorted(OUTPUT_WRITERS))))
@@ -0,0 +1,205 @@
+from collections import Counter
+import functools
+import multiprocessing
+import os
+
+import csv_scanner
+import xlsx_reader
+from report_schema import ROW_QUANTITIES, read_columns
+
+
+"""
+
+Parallel parsing of the input csv files of OrderDiscrepancyComparisonScript.
+Each file is split into byte ranges at line boundaries and every range is parsed
+and pre-aggregated by (order_id, sku) in a worker process of a pool.
+Partial results are returned to the parent process, which merges them.
+Parsed files can be kept in a report_cache.ReportCache, so they are not parsed again.
+
+Files are read by csv_scanner, which gives a parser only the columns of the file schema (see report_schema),
+they are resolved from the file header before the file is split.
+Byte ranges are cut at new lines, so a file must not have new lines inside quoted fields
+to be split. Files smaller than 'chunk_size' are parsed by one worker as a whole.
+A sheet of the debug report workbook is parsed by one worker, so its three sheets are parsed at the same time.
+
+"""
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _parse_version(rows):
+	order_skus = Counter()
+	for order_id, sku in rows:
+		# order_id and sku might be empty
+		if (order_id and sku):
+			order_skus[(order_id, sku)] += 1
+	return order_skus
+
+
+def _parse_debug_sheet(row_quantity, rows):
+	qtys = {}
+	for row in rows:
+		key_qtys = qtys.setdefault(row[:2], {})
+		qty_name, qty = row_quantity(row)
+		if qty_name:
+			key_qtys[qty_name] = key_qtys.get(qty_name, 0) + qty
+	return qtys
+
+
+# Parsers of the file kinds. A version parser returns a Counter of (order_id, sku),
+# a debug sheet parser returns a dict of (order_id, sku) to a dict of quantities sums
+PARSERS = {
+	'version': _parse_version,
+	'reimbursements': functools.partial(_parse_debug_sheet, ROW_QUANTITIES['reimbursements']),
+	'returns_to_fba': functools.partial(_parse_debug_sheet, ROW_QUANTITIES['returns_to_fba']),
+	'date_range': functools.partial(_parse_debug_sheet, ROW_QUANTITIES['date_range']),
+}
+
+
+def _range_end(end, size):
+	# The last range is read to the end of the file, so its lines are not counted one by one
+	return end if end < size else None
+
+
+def parse_chunk(task):
+	"""
+	Parse one byte range of a file in a worker process
+	:param task: A tuple of (file kind, file path, columns, start, end), 'end' is None for the end of the file
+	"""
+	kind, path, columns, start, end = task
+	if xlsx_reader.is_workbook(path):
+		return PARSERS[kind](xlsx_reader.sheet_rows(path, kind, columns))
+	with open(path, 'rb') as csvfile:
+		rows = csv_scanner.scan_rows(csvfile, columns, start, end)
+		if not start:
+			next(rows, None) # not to read column titles
+		return PARSERS[kind](rows)
+
+
+
+class ParallelReader(object):
+	"""
+	Pool of worker processes parsing the input files. If 'workers' is not set,
+	files are parsed in this process when their results are taken.
+	If 'cache' is given, a file found there is not parsed and results of parsed files are put there.
+	A daemon process (a job of a batch pool) cannot have children, so it parses the files itself whatever 'workers' is.
+
+	:param workers: Number of worker processes
+	:param chunk_size: Max size of a byte range of a file parsed by one worker
+	:param cache: A report_cache.ReportCache
+	"""
+
+	def __init__(self, workers, chunk_size=CHUNK_SIZE, cache=None):
+		if multiprocessing.current_process().daemon:
+			workers = None
+		self.pool = multiprocessing.Pool(workers) if workers else None
+		self.chunk_size = chunk_size
+		self.cache = cache
+
+	def submit(self, kind, path, columns=None):
+		"""
+		Start parsing a file, it's split into byte ranges of 'chunk_size'
+		:param columns: Columns of the file resolved by report_schema, they are read from its header if not given
+		:return: A ParsedFile
+		"""
+		# Columns are a part of the cache key, so they are resolved first
+		columns = columns or read_columns(kind, path)
+		if self.cache:
+			cached = self.cache.get(kind, path, columns)
+			if cached is not None:
+				return ParsedFile(kind, path, columns, partials=[cached])
+
+		async_result = None
+		if self.pool:
+			# A workbook sheet cannot be split, it's parsed as a whole
+			size = os.path.getsize(path) if not xlsx_reader.is_workbook(path) else 0
+			tasks = [
+				(kind, path, columns, start, _range_end(start + self.chunk_size, size)) for start in xrange(0, size, self.chunk_size)
+			]
+			async_result = self.pool.map_async(parse_chunk, tasks or [(kind, path, columns, 0, None)])
+		return ParsedFile(kind, path, columns, async_result=async_result, cache=self.cache)
+
+	def close(self):
+		if self.pool:
+			self.pool.close()
+			self.pool.join()
+
+	def terminate(self):
+		# Stop the workers at once, e.g. when the run has failed
+		if self.pool:
+			self.pool.terminate()
+			self.pool.join()
+
+
+
+class ParsedFile(object):
+	"""
+	Result of parsing a file by ParallelReader, 'get()' returns the list of partial results of its byte ranges
+	"""
+
+	def __init__(self, kind, path, columns, partials=None, async_result=None, cache=None):
+		self.kind = kind
+		self.path = path
+		self.columns = columns
+		self.partials = partials
+		self.async_result = async_result
+		self.cache = cache
+
+	def get(self):
+		if self.partials is None:
+			if self.async_result:
+				self.partials = self.async_result.get()
+			else:
+				self.partials = [parse_chunk((self.kind, self.path, self.columns, 0, None))]
+			if self.cache:
+				merged = merge_partials(self.kind, self.partials)
+				self.cache.put(self.kind, self.path, self.columns, merged)
+				self.partials = [merged]
+		return self.partials
+
+
+
+def merge_version(partials):
+	order_skus = Counter()
+	for partial in partials:
+		order_skus.update(partial)
+	return order_skus
+
+
+def merge_partials(kind, partials):
+	"""
+	Merge partial results of a file into one dict
+	"""
+	if kind == 'version':
+		return dict(merge_version(partials))
+	merged = {}
+	for partial in partials:
+		for order_sku, qtys in partial.iteritems():
+			merged_qtys = merged.setdefault(order_sku, {})
+			for qty_name, qty in qtys.iteritems():
+				merged_qtys[qty_name] = merged_qtys.get(qty_name, 0) + qty
+	return merged
+
+
+def merge_debug_sheet(partials, index, add_debug_qty):
+	"""
+	Merge partial results of a debug sheet into the keys of 'index',
+	keys which are not in 'index' are dropped
+
+	:param partials: Partial results of the sheet ranges
+	:param index: A dict of (order_id, sku) to the key data, e.g. 'reports_data'
+	:param add_debug_qty: A function(data, qty_name, qty) adding a quantity to the key data
+	:return: Number of keys matched
+	"""
+	matched_count = 0
+	for partial in partials:
+		for order_sku, qtys in partial.iteritems():
+			data = index.get(order_sku)
+			if data is None:
+				continue
+			matched_count += 1
+			# Keys without quantities are still in debug
+			add_debug_qty(data, None, 0)
+			for qty_name, qty in qtys.iteritems():
+				add_debug_qty(data, qty_name, qty)
+	return matched_count
@@ -0,0 +1,119 @@
+import cPickle
+import os
+import shutil
+import tempfile
+
+
+"""
+
+Hash partitioned spill files of the input rows of OrderDiscrepancyComparisonScript, to compare
+reports which don't fit into memory. Rows are split into partitions by the hash of their (order_id, sku),
+so all the rows of a key are in the same partition, and each partition is compared on its own.
+Rows are buffered and written to the partition files in chunks of (source, rows), a partition is read back
+chunk by chunk in the order the chunks were written. Partition files have paths in a temporary
+directory of the spill, so a partition can be read by another process, which gets the spill pickled:
+
+	spill = PartitionSpill(16)
+	spill.add_rows(0, old_version_rows)
+	spill.add_rows(2, reimbursements_rows)
+	for source, rows in spill.chunks(3):
+		...
+	spill.close()
+
+"""
+
+# Rows buffered in memory before they are written, for all the partitions together
+DEFAULT_BUFFER_ROWS = 500000
+
+# Bytes of the beginning of a file to estimate its rows count by
+SAMPLE_SIZE = 64 * 1024
+
+
+
+class PartitionSpill(object):
+	"""
+	:param partitions: Number of partitions
+	:param buffer_rows: Max number of rows buffered in memory
+	:param spill_dir: A directory to make the spill directory in, the temporary one by default
+	"""
+
+	def __init__(self, partitions, buffer_rows=None, spill_dir=None):
+		self.partitions = partitions
+		self.buffer_rows = buffer_rows or DEFAULT_BUFFER_ROWS
+		self.directory = tempfile.mkdtemp(prefix='partitions_', dir=spill_dir)
+		self.files = []
+		try:
+			for partition in xrange(partitions):
+				self.files.append(open(self.path('partition_{}'.format(partition)), 'wb'))
+		except:
+			self.close()
+			raise
+		self.buffers = [[] for _ in xrange(partitions)]
+
+	def __getstate__(self):
+		# A pickled spill reads the partitions and makes files in the directory only,
+		# it's not closed by the process it's given to, as the directory belongs to the spill which made it
+		return dict(self.__dict__, files=[], buffers=[])
+
+	def path(self, file_name):
+		# A path of a file in the spill directory, it's removed with the directory
+		return os.path.join(self.directory, file_name)
+
+	def add_rows(self, source, rows):
+		"""
+		Split the rows of a source into the partitions. The rows of a source are written
+		before the rows of the next one, so a partition is read back source by source
+		:param source: A number of the rows source, e.g. of the input file
+		:param rows: An iterable of tuples, (order_id, sku) are the first two items
+		:return: Number of the rows
+		"""
+		partitions, buffers, buffer_rows = self.partitions, self.buffers, self.buffer_rows
+		rows_count = buffered = 0
+		for row in rows:
+			buffers[hash(row[:2]) % partitions].append(row)
+			buffered += 1
+			if buffered == buffer_rows:
+				rows_count += buffered
+				buffered = 0
+				self._flush(source)
+		self._flush(source)
+		# The rows are on the disk then, so the partitions can be read by other processes
+		for partition_file in self.files:
+			partition_file.flush()
+		return rows_count + buffered
+
+	def _flush(self, source):
+		for partition_file, buffer in zip(self.files, self.buffers):
+			if buffer:
+				cPickle.dump((source, buffer), partition_file, cPickle.HIGHEST_PROTOCOL)
+				del buffer[:]
+
+	def chunks(self, partition):
+		"""
+		:return: An iterator of (source, rows) chunks of the partition
+		"""
+		with open(self.path('partition_{}'.format(partition)), 'rb') as partition_file:
+			while True:
+				try:
+					yield cPickle.load(partition_file)
+				except EOFError:
+					return
+
+	def close(self):
+		for partition_file in self.files:
+			partition_file.close()
+		shutil.rmtree(self.directory, ignore_errors=True)
+
+
+
+def estimate_rows(path):
+	"""
+	Estimate the rows count of a csv file by the average length of the lines in its beginning
+	"""
+	size = os.path.getsize(path)
+	with open(path, 'rb') as csvfile:
+		sample = csvfile.read(SAMPLE_SIZE)
+	lines_count = sample.count('\n')
+	if not lines_count or len(sample) == size:
+		return lines_count or 1
+	return size * lines_count // len(sample)
@@ -0,0 +1,81 @@
+import Queue
+import sys
+import threading
+
+
+"""
+
+Stages of a streaming run of OrderDiscrepancyComparisonScript connected by bounded queues.
+Each stage is a generator running in its own thread, the items it yields are put into a queue
+of 'queue_size' items, which the next stage takes them from. A stage which is ahead of the next one
+waits for it when the queue is full, so the stages move at the pace of the slowest one.
+Items are usually batches (lists) of rows, not to pay for the queue on every row.
+
+	pipeline = Pipeline()
+	keys = pipeline.stage(read_keys, 'old.csv')
+	records = pipeline.stage(make_records, keys)
+	for batch in records:
+		...
+	pipeline.join()
+
+An error in a stage is raised in the stage which takes its items, so it reaches the main thread.
+
+"""
+
+QUEUE_SIZE = 8
+
+BATCH_SIZE = 10000
+
+_END = object()
+
+
+
+class Pipeline(object):
+	"""
+	:param queue_size: Max number of items waiting between two stages
+	"""
+
+	def __init__(self, queue_size=QUEUE_SIZE):
+		self.queue_size = queue_size
+		self.threads = []
+		self.errors = []
+
+	def stage(self, produce, *args):
+		"""
+		Run a stage in a new thread
+		:param produce: A generator function of the stage, it's called with 'args'
+		:return: An iterator of the items the stage yields
+		"""
+		queue = Queue.Queue(self.queue_size)
+		thread = threading.Thread(target=self._run, args=(produce, args, queue))
+		thread.daemon = True # A stage waiting for a failed one must not keep the script from exiting
+		thread.start()
+		self.threads.append(thread)
+		return self._take(queue)
+
+	def join(self):
+		for thread in self.threads:
+			thread.join()
+		self._raise_error()
+
+	def _run(self, produce, args, queue):
+		try:
+			for item in produce(*args):
+				queue.put(item)
+		except Exception:
+			self.errors.append(sys.exc_info())
+		finally:
+			queue.put(_END)
+
+	def _take(self, queue):
+		while True:
+			item = queue.get()
+			if item is _END:
+				self._raise_error()
+				return
+			yield item
+
+	def _raise_error(self):
+		if self.errors:
+			error_type, error, traceback = self.errors[0]
+			raise error_type, error, traceback
@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+
+"""
+
+Registry of the rules which find a reason of missing for 'reports_data' records.
+Each rule is a predicate of a ReportRecord (absent fields are unset attributes), a key of the reason in
+'OrderDiscrepancyComparisonScript.reasons' and a priority. Rules are checked
+in order of priority (the lower the earlier) and the first matching one gives the reason.
+
+To add a reason, put its description to 'OrderDiscrepancyComparisonScript.reasons' and register its rule:
+
+	@reason_rule('my_reason', priority=50)
+	def my_reason(data):
+		return getattr(data, 'returned_qty', 0) > 10
+
+"""
+
+ReasonRule = namedtuple('ReasonRule', ['priority', 'reason', 'predicate'])
+
+REASON_RULES = []
+
+
+def reason_rule(reason, priority):
+	"""
+	Decorator to register a predicate of a record as the rule of 'reason'
+	"""
+	def register(predicate):
+		REASON_RULES.append(ReasonRule(priority, reason, predicate))
+		return predicate
+	return register
+
+
+def compile_reason_rules(rules, reasons):
+	"""
+	Order rules by priority and resolve their reasons descriptions
+	:return: A list of (predicate, reason description) tuples
+	"""
+	return [(rule.predicate, reasons[rule.reason]) for rule in sorted(rules, key=lambda rule: rule.priority)]
+
+
+
+@reason_rule('not_in_debug', priority=10)
+def not_in_debug(data):
+	return not getattr(data, 'in_debug', False)
+
+
+@reason_rule('refund_without_order', priority=20)
+def refund_without_order(data):
+	return getattr(data, 'order_qty', 0) == 0 and getattr(data, 'refund_qty', 0) > 0
+
+
+@reason_rule('refunds_qty_greater_than_orders', priority=30)
+def refunds_qty_greater_than_orders(data):
+	order_qty = getattr(data, 'order_qty', 0)
+	if order_qty != 0 and order_qty < getattr(data, 'refund_qty', 0):
+		# In new logic refund qty cannot be greater than orders
+		# if so, we should make refund qty the same as order qty
+		refund_qty = order_qty
+		variance = refund_qty - getattr(data, 'reimbursed_qty', 0) - getattr(data, 'returned_qty', 0)
+		return variance <= 0
+	return False
+
+
+@reason_rule('should_be_in_report', priority=40)
+def should_be_in_report(data):
+	variance = getattr(data, 'refund_qty', 0) - getattr(data, 'reimbursed_qty', 0) - getattr(data, 'returned_qty', 0)
+	return variance > 0 and bool(getattr(data, 'order_qty', 0))
@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+import errno
+import hashlib
+import json
+import marshal
+import os
+import tempfile
+import time
+
+try:
+	import fcntl
+except ImportError: # There is no 'fcntl' module on Windows, the index is not locked there
+	fcntl = None
+
+
+"""
+
+On-disk cache of parsed input files of OrderDiscrepancyComparisonScript.
+An entry is the pre-aggregated result of parsing a whole file by parallel_reader
+(a dict of (order_id, sku) to rows count or to quantities sums) stored with marshal.
+
+Entries are keyed by the file kind, the SHA-1 of the file content, the columns the file is parsed by
+(see report_schema) and ENTRY_FORMAT, so an entry of another layout or parser is not returned. The content hash
+of a path is remembered with its size and mtime, so an unchanged file is not hashed again
+and a changed one gets a new entry. The total size of entries is limited, least recently
+used ones are removed first. The index is read, changed and written under a file lock,
+so concurrent runs (e.g. batch jobs) sharing the cache don't lose each other's entries.
+
+"""
+
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Version of the parsed data, it has to be increased when parallel_reader parsers or report_schema quantities
+# give other results for the same file, entries of the previous versions are not used then and are evicted in time
+ENTRY_FORMAT = 1
+
+
+
+class ReportCache(object):
+	"""
+	:param cache_dir: A directory to keep the entries in, it's created if needed
+	:param max_size: Max total size of the entries in bytes
+	"""
+
+	def __init__(self, cache_dir, max_size=None):
+		self.cache_dir = cache_dir
+		self.max_size = max_size or DEFAULT_MAX_SIZE
+		self.index_file = os.path.join(cache_dir, 'index.json')
+		self.lock_file = os.path.join(cache_dir, 'index.lock')
+		try:
+			os.makedirs(cache_dir)
+		except OSError as error:
+			# Concurrent runs may create it at the same time
+			if error.errno != errno.EEXIST or not os.path.isdir(cache_dir):
+				raise
+
+	def get(self, kind, path, columns):
+		"""
+		:param columns: Columns of the file resolved by report_schema
+		:return: Parsed file data or None if it isn't in the cache
+		"""
+		file_path, file_info = self._file_info(path)
+		with self._locked_index() as index:
+			index['files'][file_path] = file_info # The file hash might have been updated
+			entry_name = _entry_name(kind, file_info, columns)
+			entry_file = os.path.join(self.cache_dir, entry_name)
+			if entry_name not in index['entries'] or not os.path.isfile(entry_file):
+				return None
+			index['entries'][entry_name]['used'] = time.time()
+			# An open entry can still be read when another run evicts it
+			cached = open(entry_file, 'rb')
+
+		with cached:
+			return marshal.load(cached)
+
+	def put(self, kind, path, columns, data):
+		file_path, file_info = self._file_info(path)
+		entry_name = _entry_name(kind, file_info, columns)
+		entry_file = os.path.join(self.cache_dir, entry_name)
+
+		with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as cached:
+			marshal.dump(data, cached.file)
+		with self._locked_index() as index:
+			os.rename(cached.name, entry_file)
+			index['files'][file_path] = file_info
+			index['entries'][entry_name] = {'size': os.path.getsize(entry_file), 'used': time.time()}
+			self._evict(index)
+
+	def _file_info(self, path):
+		# Size, mtime and content hash of a file, an unchanged file is not hashed again.
+		# It's taken without the lock, as hashing a big file would keep the other runs waiting
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		known = self._load_index()['files'].get(path)
+		if not known or known['size'] != stat.st_size or known['mtime'] != stat.st_mtime:
+			known = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': _file_sha1(path)}
+		return path, known
+
+	def _evict(self, index):
+		# Remove least recently used entries until the total size fits 'max_size'.
+		# Entry files which are not in the index (e.g. written by a run which was killed) are counted too
+		entries = index['entries']
+		for entry_name in os.listdir(self.cache_dir):
+			if entry_name.endswith('.marshal') and entry_name not in entries:
+				entries[entry_name] = {'size': os.path.getsize(os.path.join(self.cache_dir, entry_name)), 'used': 0}
+		total_size = sum(entry['size'] for entry in entries.itervalues())
+		for entry_name in sorted(entries, key=lambda name: entries[name]['used']):
+			if total_size <= self.max_size:
+				break
+			total_size -= entries.pop(entry_name)['size']
+			entry_file = os.path.join(self.cache_dir, entry_name)
+			if os.path.isfile(entry_file):
+				os.remove(entry_file)
+
+	@contextmanager
+	def _locked_index(self):
+		# The index to change, it's saved when the block ends without an error
+		with open(self.lock_file, 'ab') as lock:
+			if fcntl:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			index = self._load_index()
+			yield index
+			self._save_index(index)
+
+	def _load_index(self):
+		if not os.path.isfile(self.index_file):
+			return {'files': {}, 'entries': {}}
+		with open(self.index_file, 'rb') as index_file:
+			return json.load(index_file)
+
+	def _save_index(self, index):
+		# Index is replaced at once, so a concurrent run never reads a half written one
+		with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as index_file:
+			json.dump(index, index_file)
+		os.rename(index_file.name, self.index_file)
+
+
+
+def _entry_name(kind, file_info, columns):
+	return '{}-{}-{}-v{}.marshal'.format(kind, file_info['sha1'], '_'.join(str(column) for column in columns), ENTRY_FORMAT)
+
+
+def _file_sha1(path):
+	sha1 = hashlib.sha1()
+	with open(path, 'rb') as hashed:
+		for block in iter(lambda: hashed.read(HASH_BLOCK_SIZE), ''):
+			sha1.update(block)
+	return sha1.hexdigest()
@@ -0,0 +1,61 @@
+import threading
+
+
+"""
+
+Compact record of one (order_id, sku) key of 'reports_data'.
+A record keeps its fields in __slots__ instead of a per-key dict and stores its reason as
+a small int code of a shared reasons table, version labels are interned strings.
+An absent field is an unset slot, so it's read with a default:
+
+	data.status = 'MISSING'
+	getattr(data, 'order_qty', 0)
+
+"""
+
+
+class ReportRecord(object):
+
+	__slots__ = (
+		'status', 'is_in', 'missing_in', 'reason_code', 'reason_found', 'in_debug',
+		'order_qty', 'refund_qty', 'returned_qty', 'reimbursed_qty', 'old_count', 'new_count',
+		)
+
+	# Reasons descriptions by their codes and codes by descriptions, shared by all the records
+	reasons_table = []
+	reasons_codes = {}
+	reasons_lock = threading.Lock()
+
+	@classmethod
+	def reason_code_of(cls, reason):
+		code = cls.reasons_codes.get(reason)
+		if code is None:
+			# Comparisons of the service run in threads, a new reason has to get one code in all of them.
+			# It's put to the table before its code is known, so a known code is always in the table
+			with cls.reasons_lock:
+				code = cls.reasons_codes.get(reason)
+				if code is None:
+					cls.reasons_table.append(reason)
+					code = cls.reasons_codes[reason] = len(cls.reasons_table) - 1
+		return code
+
+	def _get_reason(self):
+		return self.reasons_table[self.reason_code]
+
+	def _set_reason(self, reason):
+		self.reason_code = self.reason_code_of(reason)
+
+	reason = property(_get_reason, _set_reason)
+
+	def items(self):
+		fields = [name for name in self.__slots__ if name != 'reason_code'] + ['reason']
+		return [(name, getattr(self, name)) for name in fields if hasattr(self, name)]
+
+	def __eq__(self, other):
+		return dict(self.items()) == dict(other.items())
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return 'ReportRecord({})'.format(', '.join('{}={!r}'.format(name, value) for name, value in self.items()))
@@ -0,0 +1,157 @@
+from collections import namedtuple
+import csv
+import re
+
+import xlsx_reader
+
+
+"""
+
+Schemas of the input csv files of OrderDiscrepancyComparisonScript.
+Column indexes are resolved from the header row of a file once, before the file is read,
+so a changed export layout fails at once with a clear error instead of summing a wrong column.
+Titles are compared ignoring case, spaces, dashes and underscores ('amazon-order-id' is 'Amazon Order ID').
+
+Rows are read with the resolved columns in the order of the schema, (order_id, sku) are the first ones:
+
+	columns = read_columns('date_range', 'date_range.csv')
+	for order_id, sku, order_condition, quantity in csv_scanner.scan_rows(csvfile, columns):
+		QUANTITIES[quantity]
+
+A debug sheet row gives its quantity by ROW_QUANTITIES of the sheet, the same for every way the sheet is read.
+
+"""
+
+Column = namedtuple('Column', ['name', 'titles'])
+
+# Columns of the file kinds and their known titles, the first matching title is taken
+SCHEMAS = {
+	'version': (
+		Column('order_id', ('order-id', 'amazon-order-id')),
+		Column('sku', ('sku', 'seller-sku')),
+		),
+	'reimbursements': (
+		Column('order_id', ('amazon-order-id', 'order-id')),
+		Column('sku', ('sku', 'seller-sku')),
+		Column('reimbursed_qty', ('quantity-reimbursed-total',)),
+		),
+	'returns_to_fba': (
+		Column('order_id', ('order-id', 'amazon-order-id')),
+		Column('sku', ('sku', 'seller-sku')),
+		Column('returned_qty', ('quantity',)),
+		),
+	'date_range': (
+		Column('order_id', ('order-id', 'amazon-order-id')),
+		Column('sku', ('sku', 'seller-sku')),
+		Column('order_condition', ('type',)), # 'Order' or 'Refund'
+		Column('quantity', ('quantity',)),
+		),
+}
+
+
+# Kinds of the debug report sheets
+DEBUG_SHEETS = ('reimbursements', 'returns_to_fba', 'date_range')
+
+
+def _normalize_title(title):
+	return re.sub(r'[\s_-]', '', title).lower()
+
+
+def resolve_columns(kind, header):
+	"""
+	:param kind: A file kind of SCHEMAS
+	:param header: Column titles of the file
+	:return: A tuple of the column indexes in the order of the schema
+	"""
+	positions = {}
+	for position, title in enumerate(header):
+		positions.setdefault(_normalize_title(title), position)
+
+	columns = []
+	missing = []
+	for column in SCHEMAS[kind]:
+		found = [positions[_normalize_title(title)] for title in column.titles if _normalize_title(title) in positions]
+		if found:
+			columns.append(found[0])
+		else:
+			missing.append('{} ({})'.format(column.name, ' or '.join(column.titles)))
+	if missing:
+		raise ValueError('Columns {} are not found in {} file header: {}'.format(
+			', '.join(missing), kind, ', '.join(header)))
+	return tuple(columns)
+
+
+def read_columns(kind, path):
+	"""
+	Resolve the columns of a file from its header row, a debug report workbook gives the header of the sheet of 'kind'
+	"""
+	if xlsx_reader.is_workbook(path):
+		header = xlsx_reader.read_header(path, kind)
+	else:
+		with open(path, 'rb') as csvfile:
+			header = next(csv.reader(csvfile, delimiter=','), [])
+	try:
+		return resolve_columns(kind, header)
+	except ValueError as error:
+		raise ValueError('{}: {}'.format(path, error))
+
+
+
+def job_arguments(job):
+	"""
+	OrderDiscrepancyComparisonScript arguments of a job decoded from JSON, e.g. of a batch manifest or a service request
+	"""
+	return dict((str(argument), _to_str(value)) for argument, value in job.iteritems())
+
+
+def _to_str(value):
+	# JSON strings are unicode, file names have to be str as everywhere else in the script
+	return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+
+# Max number of distinct quantity texts kept by QUANTITIES, it's emptied when it's full,
+# so a long-running process (see comparison_service) doesn't keep every text it has seen
+MAX_QUANTITIES = 100000
+
+
+class _Quantities(dict):
+	"""
+	Quantities by their text, each distinct text is converted once.
+	An empty quantity is 0 (Reimbursed, refund or order's quantity may be an empty string '')
+	"""
+
+	def __missing__(self, text):
+		if len(self) >= MAX_QUANTITIES:
+			self.clear()
+		quantity = self[text] = int(text or 0)
+		return quantity
+
+
+QUANTITIES = _Quantities()
+
+
+def _reimbursements_quantity(row):
+	return 'reimbursed_qty', QUANTITIES[row[2]]
+
+
+def _returns_to_fba_quantity(row):
+	return 'returned_qty', QUANTITIES[row[2]]
+
+
+def _date_range_quantity(row):
+	order_condition = row[2] # 'Refund' or 'Order'
+	if order_condition == 'Order':
+		return 'order_qty', QUANTITIES[row[3]]
+	if order_condition == 'Refund':
+		return 'refund_qty', QUANTITIES[row[3]]
+	return None, 0
+
+
+# Quantity of a debug sheet row by the sheet kind: a function(row) returning (qty_name, qty),
+# a row has the schema columns only. A row without a quantity gives (None, 0), its key is still in debug
+ROW_QUANTITIES = {
+	'reimbursements': _reimbursements_quantity,
+	'returns_to_fba': _returns_to_fba_quantity,
+	'date_range': _date_range_quantity,
+}
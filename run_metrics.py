@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+	import resource
+except ImportError: # There is no 'resource' module on Windows, peak RSS is not measured there
+	resource = None
+
+
+"""
+
+Metrics of the stages of a run of OrderDiscrepancyComparisonScript:
+wall time, CPU time, rows in and out, keys matched and peak RSS of each stage.
+
+	metrics = RunMetrics(profile_dir='profiles')
+	with metrics.stage('debug_join') as stage:
+		stage.rows_in, stage.keys_matched = join()
+	metrics.save('metrics.json')
+
+CPU time is the time of the script process, 'children_cpu_seconds' is the time of the worker processes
+which have exited by the end of the stage. Peak RSS is the max resident memory of the script process
+since it started, so it's the peak of the stage or of an earlier one.
+With 'profile_dir' each stage is run under cProfile and its profile is dumped to '<profile_dir>/<stage>.prof',
+it can be read by pstats or snakeviz. Only the script process is profiled, not the worker ones.
+
+"""
+
+# Titles and widths of the metrics sheet columns of the output workbook
+METRICS_COLUMNS = [
+	('Stage', 20), ('Wall, s', 10), ('CPU, s', 10), ('Children CPU, s', 10), ('Rows in', 12), ('Rows out', 12),
+	('Keys matched', 12), ('Peak RSS, MB', 12)
+	]
+
+
+
+class StageMetrics(object):
+	"""
+	Metrics of one stage, a stage sets its counters which it knows, the others stay None
+	"""
+
+	FIELDS = ('name', 'wall_seconds', 'cpu_seconds', 'children_cpu_seconds', 'rows_in', 'rows_out',
+			  'keys_matched', 'peak_rss_mb')
+
+	def __init__(self, name):
+		for field in self.FIELDS:
+			setattr(self, field, None)
+		self.name = name
+
+	def as_dict(self):
+		return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+	def row(self):
+		return [getattr(self, field) for field in self.FIELDS]
+
+
+
+class RunMetrics(object):
+	"""
+	:param profile_dir: A directory to dump the cProfile profiles of the stages to, they are not profiled if it's not set
+	"""
+
+	def __init__(self, profile_dir=None):
+		self.profile_dir = profile_dir
+		self.stages = []
+		self.start = time.time()
+		if profile_dir and not os.path.isdir(profile_dir):
+			os.makedirs(profile_dir)
+
+	@contextmanager
+	def stage(self, name):
+		"""
+		Measure the stage run in the 'with' block, the block gets StageMetrics to set the counters of
+		"""
+		stage = StageMetrics(name)
+		profile = cProfile.Profile() if self.profile_dir else None
+		start_times = os.times()
+		start = time.time()
+		if profile:
+			profile.enable()
+		try:
+			yield stage
+		finally:
+			if profile:
+				profile.disable()
+			end_times = os.times()
+			stage.wall_seconds = round(time.time() - start, 3)
+			stage.cpu_seconds = round(sum(end_times[:2]) - sum(start_times[:2]), 3)
+			stage.children_cpu_seconds = round(sum(end_times[2:4]) - sum(start_times[2:4]), 3)
+			stage.peak_rss_mb = peak_rss_mb()
+			self.stages.append(stage)
+			if profile:
+				profile.dump_stats(os.path.join(self.profile_dir, '{}.prof'.format(name)))
+
+	def as_dict(self):
+		return {
+			'wall_seconds': round(time.time() - self.start, 3),
+			'peak_rss_mb': peak_rss_mb(),
+			'stages': [stage.as_dict() for stage in self.stages],
+		}
+
+	def rows(self):
+		# Rows of the metrics sheet, one per stage
+		return [stage.row() for stage in self.stages]
+
+	def save(self, metrics_file):
+		"""
+		Write the metrics to a JSON file. It's written to a temporary file first,
+		so a failed write doesn't leave a broken file
+		"""
+		metrics_dir = os.path.dirname(os.path.abspath(metrics_file))
+		temp_fd, temp_file = tempfile.mkstemp(dir=metrics_dir, suffix='.tmp')
+		try:
+			with os.fdopen(temp_fd, 'wb') as metrics:
+				json.dump(self.as_dict(), metrics, indent=2, sort_keys=True)
+			os.rename(temp_file, metrics_file)
+		except:
+			os.remove(temp_file)
+			raise
+
+
+
+def peak_rss_mb():
+	"""
+	:return: Max resident memory of the script process in MB or None if it can't be measured
+	"""
+	if resource is None:
+		return None
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# It's in bytes on macOS and in kilobytes on Linux
+	if sys.platform == 'darwin':
+		peak_rss /= 1024
+	return round(peak_rss / 1024.0, 1)
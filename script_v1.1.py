@@ -1,26 +1,18 @@
 from datetime import datetime
 import csv
-from openpyxl import Workbook
+import sys
 
 """
 
 HOW TO USE IT:
 
-1. Put file paths to the variables below
-2. Run the script
-3. The result file will appear in the same directory where this script is
+1. Run the script with the file paths:
+	python script_v1.1.py <old version> <new version> [<reimbursements> <returns_to_fba> <date_range>]
+   Debug files can be omitted, all three of them (in this case missing data will not have a reason description in output file)
+2. The result file will appear in the directory the script is run in
 
 """
 
-# These cannot be empty
-OLD_VERSION = 'to_comp_Jacob/51.csv'
-NEW_VERSION = 'to_comp_Jacob/26.csv'
-
-# Can be empty (in this case missing data will not have a reason description in output file)
-DEBUG_REPORT_REIMBURSEMENTS = 'to_comp_Jacob/reimbursements.csv'
-DEBUG_REPORT_RETURNS_TO_FBA = 'to_comp_Jacob/returns_to_fba.csv'
-DEBUG_REPORT_DATE_RANGE = 'to_comp_Jacob/date_range.csv'
-
 
 
 def compare_order_discrepancy_report_versions(old_version, 
@@ -66,7 +58,9 @@ def compare_order_discrepancy_report_versions(old_version,
 										' (see \'Not in\' column). So variance here is <=0'		
 	}
 
-	# Make an output file to put the data into it
+	# Make an output file to put the data into it,
+	# openpyxl is imported here as its import takes longer than a small comparison
+	from openpyxl import Workbook
 	output_file = Workbook()
 	output_sheet = output_file.active
 	output_sheet.title = 'Auto Output'
@@ -142,44 +136,47 @@ def compare_order_discrepancy_report_versions(old_version,
 
 
 
-	checked_data = _check_if_items_are_in_debug(
-		missing_records, 
-		reimbursements=reimbursements, 
-		returns_to_fba=returns_to_fba, 
-		date_range=date_range
-		)
+	debug_files = (reimbursements, returns_to_fba, date_range)
+	if any(debug_files) and not all(debug_files):
+		# Missing records which are in debug get their reasons from all three sheets
+		raise ValueError('Debug files have to be given all three (reimbursements, returns_to_fba, date_range) or none of them')
+
+	if all(debug_files):
+		# Read each debug file once, missing records are looked up in this index then
+		debug_index = _build_debug_index(
+			reimbursements=reimbursements, 
+			returns_to_fba=returns_to_fba, 
+			date_range=date_range
+			)
+		checked_data = _check_if_items_are_in_debug(missing_records, debug_index)
+	else:
+		# Without the debug report missing data is written without a reason description
+		checked_data = list(missing_records)
 	print checked_data
+	# (order_id, sku) keys of the items checked already, so each item is looked up in a set, not in the list
+	checked_keys = set((item[0], item[1]) for item in checked_data)
 
 	# Check 'refund_without_order' and 'refunds_qty_greater_than_orders' reasons
 	if date_range:
-		with open(date_range, 'rb') as csvfile:
-			debug_data = csv.reader(csvfile, delimiter=',')			
-			# Take each item from 'missing_records' list and find all records with the same order_id and sku in 'Date Range'
-			# Then count order_condition (3rd column) of the item. Its value can be 'Refund' or 'Order'
-			# If count of order records is 0 and there are refund records, then put the reason 'refund_without_order'
-			for item in missing_records:
-				if item not in checked_data:					
-					order_id = item[0] 
-					sku = item[1] 			
-					refund_records_quantity = 0 # To count the number of 'Refund' ones  in 'DateRangeCSV' sheet
-					order_records_quantity = 0 # To count the number of 'Order' ones in 'DateRangeCSV' sheet
-					# iterate through 'DateRangeCSV' sheet of the debug report to see order_condition of the item			
-					for row in debug_data:	
-						order_condition = row[2] # 3rd column in 'DataRangeCSV'. Cell value can be 'Order' or 'Refund'			
-						if order_id in row and sku in row and order_condition == 'Refund':
-							refund_records_quantity += 1
-						elif order_id in row and sku in row and order_condition == 'Order':
-							order_records_quantity += 1
-					if order_records_quantity == 0 and refund_records_quantity > 0:
-						item.append(reasons['refund_without_order'])	
-						checked_data.append(item)
-					elif order_records_quantity > refund_records_quantity:
-						item.append(reasons['refunds_qty_greater_than_orders'])
-						checked_data.append(item)
-					else:
-						item.append(reasons['unknown_reason'])	
-						checked_data.append(item)
-					csvfile.seek(0)	# Back to the begginning of the file
+		# Take each item from 'missing_records' list and get the number of its records with the same order_id and sku 
+		# in 'Date Range' by order_condition (3rd column). Its value can be 'Refund' or 'Order'
+		# If count of order records is 0 and there are refund records, then put the reason 'refund_without_order'
+		for item in missing_records:
+			if (item[0], item[1]) not in checked_keys:					
+				order_id = item[0] 
+				sku = item[1] 			
+				date_range_records = debug_index.get((order_id, sku), {})
+				refund_records_quantity = date_range_records.get('Refund', 0) # The number of 'Refund' ones in 'DateRangeCSV' sheet
+				order_records_quantity = date_range_records.get('Order', 0) # The number of 'Order' ones in 'DateRangeCSV' sheet
+				if order_records_quantity == 0 and refund_records_quantity > 0:
+					item.append(reasons['refund_without_order'])	
+					checked_data.append(item)
+				elif order_records_quantity > refund_records_quantity:
+					item.append(reasons['refunds_qty_greater_than_orders'])
+					checked_data.append(item)
+				else:
+					item.append(reasons['unknown_reason'])	
+					checked_data.append(item)
 
 
 						
@@ -199,43 +196,53 @@ def compare_order_discrepancy_report_versions(old_version,
 
 
 
-def _check_if_items_are_in_debug(missed_data, reimbursements, returns_to_fba, date_range):
-	# Expect if date_range doesn't have certain order id and sku then returns_to_fba doesn't too.	
-	checked_data = []
-		
-	for item in missed_data:
-		order_id = item[0]
-		sku = item[1]
+def _build_debug_index(reimbursements, returns_to_fba, date_range):
+	"""
+	Read each debug file once and index its records by '(order_id, sku)'
+	The index has the following format: {(order_id, sku): {'Order': 2, 'Refund': 1}}
+	where 'Order' and 'Refund' are the numbers of such records in 'DateRangeCSV' sheet.
+	Items of 'Reimbursements' and 'ReturnsToFBA' sheets get an empty dict, so they are in debug too.
 
-		item_in_debug = False
-		with open(reimbursements, 'rb') as csvfile:
-				reimbursements_data = csv.reader(csvfile, delimiter=',')	
-				next(reimbursements_data)
+	Order id and sku are taken from the columns they are in each sheet:
+	Reimbursements - 4th and 6th, ReturnsToFBA - 2nd and 3rd, DateRangeCSV - 4th and 5th
 
-				for row in reimbursements_data:
-					if order_id in row and sku in row:
-						# print 'reimbursements', order_id, sku
-						item_in_debug = True
+	:param reimbursements: A csv file of 'Reimbursements' sheet of the debug report
+	:param returns_to_fba: A csv file of 'ReturnsToFBA' sheet of the debug report
+	:param date_range: A csv file of 'DateRangeCSV' sheet of the debug report
+	"""
+	debug_index = {}
+
+	for debug_file, order_id_column, sku_column in ((reimbursements, 3, 5), (returns_to_fba, 1, 2)):
+		with open(debug_file, 'rb') as csvfile:
+			debug_data = csv.reader(csvfile, delimiter=',')
+			next(debug_data)
+
+			for row in debug_data:
+				debug_index.setdefault((row[order_id_column], row[sku_column]), {})
+
+	with open(date_range, 'rb') as csvfile:
+		debug_data = csv.reader(csvfile, delimiter=',')
+		next(debug_data)
+
+		for row in debug_data:
+			order_condition = row[2] # 3rd column in 'DataRangeCSV'. Cell value can be 'Order' or 'Refund'
+			date_range_records = debug_index.setdefault((row[3], row[4]), {})
+			if order_condition in ('Order', 'Refund'):
+				date_range_records[order_condition] = date_range_records.get(order_condition, 0) + 1
 
-		with open(returns_to_fba, 'rb') as csvfile:
-				returns_to_fba_data = csv.reader(csvfile, delimiter=',')	
-				next(returns_to_fba_data)
+	return debug_index
 
-				for row in returns_to_fba_data:
-					if order_id in row and sku in row:
-						# print 'returns_to_fba', order_id, sku
-						item_in_debug = True
 
-		with open(date_range, 'rb') as csvfile:
-				debug_data = csv.reader(csvfile, delimiter=',')	
-				next(debug_data)
 
-				for row in debug_data:
-					if order_id in row and sku in row:
-						# print 'date_range', order_id, sku, row[2]
-						item_in_debug = True
+def _check_if_items_are_in_debug(missed_data, debug_index):
+	# Expect if date_range doesn't have certain order id and sku then returns_to_fba doesn't too.	
+	checked_data = []
+		
+	for item in missed_data:
+		order_id = item[0]
+		sku = item[1]
 
-		if not item_in_debug:
+		if (order_id, sku) not in debug_index:
 			item.append('Item is not in debug')		
 			checked_data.append(item)
 
@@ -244,10 +251,7 @@ def _check_if_items_are_in_debug(missed_data, reimbursements, returns_to_fba, da
 
 
 if __name__ == '__main__':
-	compare_order_discrepancy_report_versions(old_version=OLD_VERSION,
-											  new_version=NEW_VERSION,
-											  reimbursements=DEBUG_REPORT_REIMBURSEMENTS,
-											  returns_to_fba=DEBUG_REPORT_RETURNS_TO_FBA,
-											  date_range=DEBUG_REPORT_DATE_RANGE,
-											  )
+	if len(sys.argv) not in (3, 6):
+		sys.exit('Usage: python script_v1.1.py <old version> <new version> [<reimbursements> <returns_to_fba> <date_range>]')
+	compare_order_discrepancy_report_versions(*sys.argv[1:])
 	
@@ -1,46 +1,66 @@
+from collections import Counter, OrderedDict
+import argparse
 from datetime import datetime
-import csv
-from openpyxl import Workbook
+from itertools import ifilter, islice, starmap
+import math
+import multiprocessing
 import os
+import sys
+import time
+
+import columnar_engine
+import csv_scanner
+import external_sort
+import incremental_state
+import lookup_index
+import parallel_reader
+import xlsx_reader
+from pipeline import BATCH_SIZE, Pipeline
+from output_writers import OUTPUT_WRITERS, get_output_writer
+from partition_spill import PartitionSpill, estimate_rows
+from reason_rules import REASON_RULES, compile_reason_rules
+from report_cache import ReportCache
+from report_record import ReportRecord
+from run_metrics import METRICS_COLUMNS, RunMetrics
+from report_schema import DEBUG_SHEETS, ROW_QUANTITIES, job_arguments, read_columns
 
 
 """
 
 HOW TO USE IT:
 
-1. Put file paths to the variables below
-2. Run the script
-3. The result file will appear in the same directory where this script is
-
-"""
+Run the script with the paths of the input files, the result file will appear in the current directory
+(or in '--output-dir'). All three debug sheets are needed, as csv files or as the sheets of the debug report workbook:
+	python script_v1.4.py --old-version 51.csv --new-version 26.csv --reimbursements reimbursements.csv \
+		--returns-to-fba returns_to_fba.csv --date-range date_range.csv
+	python script_v1.4.py --old-version 51.csv --new-version 26.csv --debug-report debug.xlsx --output-format csv
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-FILES_DIR = BASE_DIR + '/files/'
+'python setup.py install' (or 'pip install .') installs it as 'order-discrepancy-compare' command,
+see 'python script_v1.4.py --help' for all the options. openpyxl is imported only when a workbook is read or written,
+so a small comparison with csv output starts fast. To make sure the inputs are fine without running
+the comparison (the files exist, csv headers have the needed columns, the debug report has the debug sheets):
+	python script_v1.4.py --check --old-version 51.csv --new-version 26.csv --debug-report debug.xlsx
 
-# These cannot be empty
-OLD_VERSION = FILES_DIR + 'to_comp_Jacob/51.csv'
-NEW_VERSION = FILES_DIR + 'to_comp_Jacob/26.csv'
+To compare many clients at once, run the script with a manifest of jobs (see 'batch_runner'):
+	python script_v1.4.py jobs.json [concurrency]
+	python script_v1.4.py 'files/to_comp_*' [concurrency]
 
-# Can be empty (in this case missing data will not have a reason description in output file)
-DEBUG_REPORT_REIMBURSEMENTS = FILES_DIR + 'to_comp_Jacob/reimbursements.csv'
-DEBUG_REPORT_RETURNS_TO_FBA = FILES_DIR + 'to_comp_Jacob/returns_to_fba.csv'
-DEBUG_REPORT_DATE_RANGE = FILES_DIR + 'to_comp_Jacob/date_range.csv'
+To explain single keys without a comparison run, build a lookup index of the input files once (see 'build_lookup_index'):
+	python script_v1.4.py --build-index index.sqlite --old-version old.csv --new-version new.csv --debug-report debug.xlsx
+	python script_v1.4.py --lookup index.sqlite 106-5388488-2997800 3202NVYS_FBA
 
-# # These cannot be empty
-# OLD_VERSION = 'to_comp_photosavings/NEW VERSION.csv'
-# NEW_VERSION = 'to_comp_photosavings/OLD VERSION.csv'
+To run many comparisons against the same debug report, run the comparison service (see 'comparison_service'),
+it keeps the parsed debug sheets in memory between the comparisons:
+	python script_v1.4.py --serve [port]
 
-# # Can be empty (in this case missing data will not have a reason description in output file)
-# DEBUG_REPORT_REIMBURSEMENTS = 'to_comp_photosavings/REIMBURSEMENTS.csv'
-# DEBUG_REPORT_RETURNS_TO_FBA = 'to_comp_photosavings/RETURNS_TO_FBA.csv'
-# DEBUG_REPORT_DATE_RANGE = 'to_comp_photosavings/DATE_RANGE_ORDER.csv'
+"""
 
 
 
 class OrderDiscrepancyComparisonScript:
 	"""
 	Compare order discrepancy reports and put the result into an output file 
-	named as 'Order_Discrepancy_compare_result.xlsx'
+	named as 'Order_Discrepancy_comparison_result_<datetime>.xlsx' (or .csv, .jsonl, .parquet)
 	This class gets data from old_version and new_version, compare these versions and 
 	compute, which items are missing, which are not. Then it's looking for a reason of missing in debug report 
 	and put its description into the output file.
@@ -51,6 +71,25 @@ class OrderDiscrepancyComparisonScript:
 	:param reimbursements: A csv file of 'Reimbursements' sheet of the debug report
 	:param returns_to_fba: A csv file of 'ReturnsToFBA' sheet of the debug report
 	:param date_range: A csv file of 'DateRangeCSV' sheet of the debug report
+	:param output_sort_limit: Max number of output rows sorted in memory
+	:param output_format: A format of the output file: 'xlsx' (default), 'csv', 'jsonl' or 'parquet'
+	:param engine: An engine to check the reasons: 'dict' (default) or 'columnar' (needs numpy)
+	:param workers: Number of processes to parse the input files, they are parsed one by one if it's not set
+	:param output_dir: A directory to put the output file into, the current one by default
+	:param debug_aggregates: Already parsed debug sheets, e.g. shared by batch jobs. A dict of sheet name 
+		('reimbursements', 'returns_to_fba', 'date_range') to a list of parallel_reader partial results
+	:param cache_dir: A directory of the parsed files cache, files are not cached if it's not set
+	:param cache_size: Max size of the parsed files cache in bytes
+	:param state_file: A file to save the run state to, a later run with a new revision of one input file
+		compares only the changed keys then, see 'run_incremental'
+	:param debug_report: The debug report workbook (.xlsx), its 'Reimbursements', 'ReturnsToFBA' and 'DateRangeCSV'
+		sheets are read instead of the csv files which are not given. The sheets are read at the same time
+		by 'workers' processes, by three if it's not set
+	:param metrics_file: A JSON file to write the metrics of the run stages to (wall and CPU time, rows, keys matched,
+		peak RSS), see 'run_metrics'
+	:param metrics_sheet: Put the metrics of the stages before the output into 'Run Metrics' sheet of the output workbook
+	:param profile_dir: A directory to dump cProfile profiles of the run stages to
+	:param memory_budget: Approximate memory in bytes the data of 'run_out_of_core' may take
 	"""
 
 	reasons = {
@@ -65,58 +104,173 @@ class OrderDiscrepancyComparisonScript:
 	MISSING = 'MISSING'
 	FINE = 'FINE'
 
-	def __init__(self, old_version, new_version, reimbursements=None, returns_to_fba=None, date_range=None):
+	# Titles and widths of the output file columns
+	OUTPUT_COLUMNS = [
+		('Order_id', 21), ('SKU', 20), ('Order Qty', 8), ('Refund Qty', 8), ('Returned Qty', 8), 
+		('Reimbursed Qty', 8), ('Is in', 10), ('Status', 10), ('Missing in', 10), ('Reason', 40)
+		]
+
+	# Titles and widths of the changelog file columns of an incremental run
+	CHANGELOG_COLUMNS = [
+		('Order_id', 21), ('SKU', 20), ('Previous status', 10), ('Status', 10), ('Previous reason', 40), ('Reason', 40)
+		]
+
+	# Max number of output rows sorted in memory, bigger results are sorted externally
+	OUTPUT_SORT_LIMIT = 1000000
+
+	# Default memory budget of an out-of-core run and the memory a version row takes in it
+	# (its key count, record, output row and spilled debug rows), measured on synthetic reports
+	MEMORY_BUDGET = 512 * 1024 * 1024
+	VERSION_ROW_MEMORY = 1024
+
+	# Engines to check the reasons: 'dict' walks 'reports_data', 'columnar' uses NumPy arrays
+	ENGINES = ('dict', 'columnar')
+
+	def __init__(self, old_version, new_version, reimbursements=None, returns_to_fba=None, date_range=None,
+				 output_sort_limit=None, output_format='xlsx', engine='dict', workers=None,
+				 output_dir=None, debug_aggregates=None, cache_dir=None, cache_size=None, state_file=None,
+				 debug_report=None, metrics_file=None, metrics_sheet=False, profile_dir=None,
+				 memory_budget=None):
 		self.old_version = old_version
 		self.new_version = new_version
+		self.output_sort_limit = output_sort_limit or self.OUTPUT_SORT_LIMIT
+		self.output_writer = get_output_writer(output_format)
+		if metrics_sheet and output_format != 'xlsx':
+			raise ValueError('Metrics sheet can be put into xlsx output only, use \'metrics_file\' with {} output'.format(output_format))
+
+		if engine not in self.ENGINES:
+			raise ValueError('Unknown engine \'{}\'. Choose one of these: {}'.format(engine, ', '.join(self.ENGINES)))
+		if engine == 'columnar':
+			columnar_engine.require_numpy()
+			columnar_engine.require_known_rules(REASON_RULES)
+		self.engine = engine
+		self.workers = workers
+		self.parallel_reader = None
+		self.cache = ReportCache(cache_dir, cache_size) if cache_dir else None
+		self.output_dir = output_dir
+		self.state_file = state_file
+		self.columns = {} # Columns of the input files resolved from their headers
+		self.metrics = RunMetrics(profile_dir)
+		self.metrics_file = metrics_file
+		self.metrics_sheet = metrics_sheet
+		self.memory_budget = memory_budget or self.MEMORY_BUDGET
+
+		# Parsed debug sheets in format {'date_range': [partials of parallel_reader]},
+		# these sheets are not read from the files. 'debug_partials' are the sheets being parsed in parallel
+		self.debug_aggregates = dict(debug_aggregates or {})
+		self.debug_partials = {}
 
-		self.reimbursements = reimbursements
-		self.returns_to_fba = returns_to_fba
-		self.date_range = date_range
+		self.debug_report = debug_report
+		self.reimbursements = reimbursements or debug_report
+		self.returns_to_fba = returns_to_fba or debug_report
+		self.date_range = date_range or debug_report
 
 		# Dict to store the data from old and new versions
-		# order_id is a KEY and a dict of sku, order qty, refund qty, returned qty, 
+		# (order_id, sku) is a KEY and a ReportRecord of order qty, refund qty, returned qty, 
 		# status, missing in, reason is a VALUE
 		self.reports_data = {} 
 
-		# Lists of tuples in format [(order_id, sku), ]
-		# For example: [('106-5388488-2997800, 3202NVYS_FBA'), ('111-1452330-6698653, E104BTTBL_FBA')]
-		# They are needed to find missing data		
-		self.old_data_order_skus = []
-		self.new_data_order_skus = []
+		# Multisets (Counters) of tuples in format {(order_id, sku): rows count}
+		# For example: {('106-5388488-2997800', '3202NVYS_FBA'): 1, ('111-1452330-6698653', 'E104BTTBL_FBA'): 2}
+		# They are needed to find missing data, duplicated rows are counted
+		self.old_data_order_skus = Counter()
+		self.new_data_order_skus = Counter()
 
 
 
+	def _read_columns(self):
+		"""
+		Resolve the columns of all the input files from their headers before any of them is read,
+		so a file with a changed layout fails the run at once
+		"""
+		for input_name in INPUTS:
+			input_file = getattr(self, input_name)
+			if input_file:
+				self.columns[input_name] = read_columns(_input_kind(input_name), input_file)
+
+
+	def check_inputs(self):
+		"""
+		Dry run: make sure the comparison can be run without reading the input files and without loading openpyxl.
+		All the debug sheets have to be given, as a comparison run needs them. Headers of the csv files
+		are resolved as in '_read_columns', the debug report workbook is checked for the debug sheets only
+		(their headers are resolved when the run opens it). The output directory has to be writable
+		and the module of the output format has to be installed
+		:return: A list of (input name, path) of the checked input files
+		"""
+		self._require_debug_files()
+		checked = []
+		for input_name in INPUTS:
+			input_file = getattr(self, input_name)
+			if not input_file:
+				continue
+			if input_name in DEBUG_SHEETS and xlsx_reader.is_workbook(input_file):
+				xlsx_reader.check_sheets(input_file, [input_name])
+			else:
+				self.columns[input_name] = read_columns(_input_kind(input_name), input_file)
+			checked.append((input_name, input_file))
+
+		output_dir = self.output_dir or os.curdir
+		if not os.path.isdir(output_dir) or not os.access(output_dir, os.W_OK):
+			raise IOError('Output directory \'{}\' does not exist or is not writable'.format(output_dir))
+		self.output_writer.check_dependency()
+		return checked
+
+
 	def _read_reports_data_from_files(self):
 		"""
-		Read data from files and put each sku and order_id to list
+		Read data from files and count each sku and order_id
 		in format '(order_id, sku)' to find the missing data then
 		"""
+		if self.workers or self.cache or self.state_file or self.debug_report:
+			return self._read_reports_data_with_reader()
 
 		with open(self.old_version, 'rb') as csvfile:
-			old_data = csv.reader(csvfile, delimiter=',')
+			old_data = csv_scanner.scan_rows(csvfile, self.columns['old_version'])
 			next(old_data) # not to read column titles	
 
-			for row in old_data:
-				order_id = row[1]
-				sku = row[2] 
+			for order_id, sku in old_data:
 				# order_id and sku might be empty
 				if (order_id and sku):
 					order_sku = (order_id, sku)
-					self.old_data_order_skus.append(order_sku)
+					self.old_data_order_skus[order_sku] += 1
 		
 		with open(self.new_version, 'rb') as csvfile:
-			new_data = csv.reader(csvfile, delimiter=',')
+			new_data = csv_scanner.scan_rows(csvfile, self.columns['new_version'])
 			next(new_data) # not to read column titles
 
-			for row in new_data:
-				order_id = row[1] 
-				sku = row[2] 			
+			for order_id, sku in new_data:
 				# order_id and sku might be empty
 				if (order_id and sku):
 					order_sku = (order_id, sku)
-					self.new_data_order_skus.append(order_sku)
+					self.new_data_order_skus[order_sku] += 1
 		
 
+	def _read_reports_data_with_reader(self):
+		"""
+		Parse all the input files by parallel_reader: in a pool of worker processes if 'workers' is set
+		(or sheets of the debug report workbook are left to parse) and taking the already parsed ones from the cache.
+		The versions are submitted first, so the pool parses them before the debug sheets and they are not kept waiting
+		behind a big sheet. Debug sheets are parsed while the versions are compared, their results are taken
+		in '_get_reports_data_info_from_debug'
+		"""
+		debug_sheets = [
+			debug_sheet for debug_sheet in DEBUG_SHEETS
+			if getattr(self, debug_sheet) and debug_sheet not in self.debug_aggregates
+		]
+		# Workbook sheets cannot be split, each one is parsed by a process of its own
+		workbook_sheets = [debug_sheet for debug_sheet in debug_sheets if xlsx_reader.is_workbook(getattr(self, debug_sheet))]
+		self.parallel_reader = parallel_reader.ParallelReader(self.workers or len(workbook_sheets), cache=self.cache)
+		old_partials = self.parallel_reader.submit('version', self.old_version, self.columns['old_version'])
+		new_partials = self.parallel_reader.submit('version', self.new_version, self.columns['new_version'])
+		for debug_sheet in debug_sheets:
+			self.debug_partials[debug_sheet] = self.parallel_reader.submit(
+				debug_sheet, getattr(self, debug_sheet), self.columns[debug_sheet])
+
+		self.old_data_order_skus = parallel_reader.merge_version(old_partials.get())
+		self.new_data_order_skus = parallel_reader.merge_version(new_partials.get())
+
+
 
 	def _find_missing_data(self):
 		"""
@@ -124,27 +278,51 @@ class OrderDiscrepancyComparisonScript:
 		Find missing data and put it to 'self.reports_data' dict with
 		status 'MISSING'. Both versions data get status 'FINE'
 
+		Versions are compared as multisets, so if an (order_id, sku) has more rows
+		in one version than in the other, the extra rows are 'MISSING' in the other one.
+		Each lookup is a hash probe, so the whole comparison is linear.
+
 		"""
-		old_version_filename = 'old version (filename: {})'.format(self.old_version.split('/')[-1])
-		new_version_filename = 'new version (filename: {})'.format(self.new_version.split('/')[-1])
-
-		for order_sku in self.old_data_order_skus:			
-			self.reports_data[order_sku] = {}			
-			self.reports_data[order_sku]['status'] = self.FINE
-			self.reports_data[order_sku]['is_in'] = old_version_filename		
-			if order_sku not in self.new_data_order_skus:				
-				self.reports_data[order_sku]['status'] = self.MISSING
-				self.reports_data[order_sku]['missing_in'] = new_version_filename  
-				self.reports_data[order_sku]['reason'] = self.reasons['unknown']				
-					
-		for order_sku in self.new_data_order_skus:				
-			self.reports_data[order_sku] = {}			
-			self.reports_data[order_sku]['status'] = self.FINE
-			self.reports_data[order_sku]['is_in'] = new_version_filename
-			if order_sku not in self.old_data_order_skus:				
-				self.reports_data[order_sku]['status'] = self.MISSING
-				self.reports_data[order_sku]['missing_in'] = old_version_filename
-				self.reports_data[order_sku]['reason'] = self.reasons['unknown']
+		version_filenames = self._version_filenames()
+		for order_sku in set(self.old_data_order_skus).union(self.new_data_order_skus):
+			data = self.reports_data[order_sku] = ReportRecord()
+			# Counter returns 0 for absent keys
+			self._set_status(data, self.old_data_order_skus[order_sku], self.new_data_order_skus[order_sku], version_filenames)
+
+
+	def _version_filenames(self):
+		old_version_filename = intern('old version (filename: {})'.format(self.old_version.split('/')[-1]))
+		new_version_filename = intern('new version (filename: {})'.format(self.new_version.split('/')[-1]))
+		return old_version_filename, new_version_filename
+
+
+	def _set_status(self, data, old_count, new_count, version_filenames):
+		data.status = self.FINE
+		data.old_count = old_count
+		data.new_count = new_count
+		if old_count != new_count:
+			data.status = self.MISSING
+			data.reason = self.reasons['unknown']
+		self._set_version_labels(data, version_filenames)
+
+
+	def _set_version_labels(self, data, version_filenames):
+		old_version_filename, new_version_filename = version_filenames
+		old_count, new_count = data.old_count, data.new_count
+		data.is_in = new_version_filename
+		if old_count > new_count:
+			data.is_in = old_version_filename
+			data.missing_in = self._missing_in_description(new_version_filename, old_count, new_count)
+		elif new_count > old_count:
+			data.missing_in = self._missing_in_description(old_version_filename, new_count, old_count)
+
+
+	@staticmethod
+	def _missing_in_description(version_filename, is_in_count, missing_in_count):
+		# Duplicated rows which are only partly missing get their counts in the description
+		if not missing_in_count:
+			return version_filename
+		return intern('{} ({} of {} rows)'.format(version_filename, is_in_count - missing_in_count, is_in_count))
 
 
 	def _get_reports_data_info_from_debug(self):
@@ -159,174 +337,769 @@ class OrderDiscrepancyComparisonScript:
 			3. Reimbursed quantity (from reimbursements)
 			4. Returned quantity (from returns to fba)
 		All of those are needed to discover the reasons of missing
+
+		:return: A tuple of (debug rows read, keys found in debug), rows are not counted (None)
+			if any sheet has been parsed by parallel_reader
 		'''
 		print 'Getting info from debug...'
-		if not self.date_range or not self.reimbursements or not self.returns_to_fba:			
+		self._require_debug_files()
+
+		if self.engine == 'columnar':
+			# Debug info is joined into columns by key codes and put to 'self.reports_data' after that
+			self.columnar_reports = columnar_engine.ColumnarReports(self.reports_data)
+			index, aggregator = self.columnar_reports.codes, self.columnar_reports
+		else:
+			index, aggregator = self.reports_data, self
+
+		rows_count = 0
+		for debug_sheet in DEBUG_SHEETS:
+			if debug_sheet in self.debug_partials: # It's been parsed in parallel
+				self.debug_aggregates[debug_sheet] = self.debug_partials.pop(debug_sheet).get()
+
+			if debug_sheet in self.debug_aggregates:
+				parallel_reader.merge_debug_sheet(self.debug_aggregates[debug_sheet], index, aggregator.add_debug_qty)
+				rows_count = None
+			else:
+				sheet_rows_count, _ = self._join_debug_sheet(
+					getattr(self, debug_sheet), self.columns[debug_sheet], ROW_QUANTITIES[debug_sheet], index, aggregator.add_debug_qty)
+				if rows_count is not None:
+					rows_count += sheet_rows_count
+
+		if self.parallel_reader:
+			self.parallel_reader.close()
+
+		if self.engine == 'columnar':
+			self.columnar_reports.finish_join()
+		return rows_count, sum(1 for data in self.reports_data.itervalues() if getattr(data, 'in_debug', False))
+
+
+	def _require_debug_files(self):
+		if not self.date_range or not self.reimbursements or not self.returns_to_fba:
 			raise EOFError, 'Some neccessary debug files weren\'t included.'\
 			' Make sure you have included each of these: Reimbursements, ReturnsToFBA, DateRangeCSV from debug report'
-							
-		with open(self.reimbursements, 'rb') as csvfile:
-			reimbursements_data = csv.reader(csvfile, delimiter=',')	
-			next(reimbursements_data) # Not to read column titles
-
-			for row in reimbursements_data:
-				reimbursed_qty = int(row[15] or 0) # Reimbursed qty may be an empty string ''
-				order_id, sku = row[3], row[5]
-				order_sku_key = (order_id, sku)
-				if order_sku_key in self.reports_data.keys():
-					data = self.reports_data[order_sku_key]
-					data['in_debug'] = True
-					data['reimbursed_qty'] = data.get('reimbursed_qty', 0) + reimbursed_qty										
-											
-		with open(self.returns_to_fba, 'rb') as csvfile:
-			returns_to_fba_data = csv.reader(csvfile, delimiter=',')	
-			next(returns_to_fba_data) 
-
-			for row in returns_to_fba_data:
-				returned_qty = int(row[6])
-				order_id, sku = row[1], row[2]
-				order_sku_key = (order_id, sku)
-				if order_sku_key in self.reports_data.keys():
-					data = self.reports_data[order_sku_key]
-					data['in_debug'] = True
-					data['returned_qty'] = data.get('returned_qty', 0) + returned_qty											
-					
-		with open(self.date_range, 'rb') as csvfile:
-			date_range_data = csv.reader(csvfile, delimiter=',')	
-			next(date_range_data)
-
-			for row in date_range_data:	
-				order_condition = row[2] # 'Refund' or 'Order'
-				quantity = int(row[6] or 0) # Refund or order's quantity may be an empty string ''			
-				order_id, sku = row[3], row[4]
-				order_sku_key = (order_id, sku)
-				if order_sku_key in self.reports_data.keys():	
-					data = self.reports_data[order_sku_key]	
-					data['in_debug'] = True			
-					if order_condition == 'Order':
-						data['order_qty'] = data.get('order_qty', 0) + quantity	
-					elif order_condition == 'Refund':
-						data['refund_qty'] = data.get('refund_qty', 0) + quantity
-			
-
-	def _check_not_in_debug_reason(self):
-		print 'Check not in debug reason'
-		for order_sku, data in self.reports_data.iteritems():
-			if not data.get('in_debug'):
-				data['reason'] = self.reasons['not_in_debug']
-				data['reason_found'] = True
-
-
-	def _check_refund_without_order_reason(self):
-		print 'Check refund without order reason'
-		for order_sku, data in self.reports_data.iteritems():
-			if not data.get('reason_found'):
-				order_qty = data.get('order_qty', 0)
-				refund_qty = data.get('refund_qty', 0)
-				if order_qty == 0 and refund_qty > 0:
-					data['reason'] = self.reasons['refund_without_order']
-					data['reason_found'] = True
-
-
-	def _check_refunds_qty_greater_than_orders_reason(self):
-		print 'Check refunds qty greater than orders reason'
-		for order_sku, data in self.reports_data.iteritems():
-			if not data.get('reason_found'):
-				order_qty = data.get('order_qty', 0)
-				refund_qty = data.get('refund_qty', 0)
-				if order_qty != 0 and order_qty < refund_qty:
-					# In new logic refund qty cannot be greater than orders
-					# if so, we should make refund qty the same as order qty
-					refund_qty = order_qty 
-					variance = refund_qty - data.get('reimbursed_qty', 0) - data.get('returned_qty', 0)
-					if variance <= 0:
-						data['reason'] = self.reasons['refunds_qty_greater_than_orders']
-						data['reason_found'] = True
-
-
-	def _check_should_be_in_report_reason(self):		
-		print 'Check should be in report reason'
-		for order_sku, data in self.reports_data.iteritems():
-			if not data.get('reason_found'):
-				variance = data.get('refund_qty', 0) - data.get('reimbursed_qty', 0) - data.get('returned_qty', 0)
-				if variance > 0 and data.get('order_qty'):
-					data['reason'] = self.reasons['should_be_in_report']	
-					data['reason_found'] = True	
-
-
-	def _make_output_file(self):
-		output_file = Workbook()
-		output_sheet = output_file.active
-		output_sheet.title = 'Auto Output'
-
-		output_sheet.column_dimensions['A'].width = 21
-		output_sheet.column_dimensions['B'].width = 20
-		output_sheet.column_dimensions['C'].width = 8
-		output_sheet.column_dimensions['D'].width = 8
-		output_sheet.column_dimensions['E'].width = 8
-		output_sheet.column_dimensions['F'].width = 8	
-		output_sheet.column_dimensions['G'].width = 10
-		output_sheet.column_dimensions['H'].width = 10	
-		output_sheet.column_dimensions['I'].width = 10	
-		output_sheet.column_dimensions['J'].width = 40
-		
-		output_sheet.append(
-			['Order_id', 'SKU', 'Order Qty', 'Refund Qty', 'Returned Qty', 
-			'Reimbursed Qty', 'Is in', 'Status', 'Missing in', 'Reason']
-			)
 
-		result_data = []
-		for order_sku, data in self.reports_data.iteritems():
-			order_id, sku = order_sku
-			reports_data_row = [
-				order_id, 
-				sku,				
-				str(data.get('order_qty', ' ')), 
-				str(data.get('refund_qty', ' ')),
-				str(data.get('returned_qty', ' ')), 
-				str(data.get('reimbursed_qty', ' ')),
-				data['is_in'],
-				data['status'],				
-				data.get('missing_in'), 				
-				data.get('reason')
-			]
-			result_data.append(reports_data_row)
 
-		sorted_result_by_status_and_order_qty = sorted(result_data, key=lambda i: (i[6], i[2]), reverse=True)
+	def _join_debug_sheet(self, debug_file, columns, row_quantity, index, add_debug_qty):
+		"""
+		Join one sheet of the debug report to the keys of 'index' in a single streaming pass.
+		Every row is probed against 'index' by its (order_id, sku) key,
+		rows of keys which are in neither version are dropped before their quantities are parsed.
+
+		:param debug_file: A csv file of the debug report sheet
+		:param columns: Indexes of the sheet columns resolved by report_schema, (order_id, sku) are the first ones
+		:param row_quantity: A function(row) giving (qty_name, qty) of a row of the sheet, see report_schema.ROW_QUANTITIES
+		:param index: A dict of (order_id, sku) to the key data, e.g. 'self.reports_data'
+		:param add_debug_qty: A function(data, qty_name, qty) adding a quantity to the key data
+		:return: A tuple of (rows read, rows matched)
+		"""
+		with open(debug_file, 'rb') as csvfile:
+			debug_data = csv_scanner.scan_rows(csvfile, columns)
+			next(debug_data) # Not to read column titles
+			return _join_debug_rows(debug_data, row_quantity, index, add_debug_qty)
+
+
+	@staticmethod
+	def add_debug_qty(data, qty_name, qty):
+		data.in_debug = True
+		if qty_name:
+			setattr(data, qty_name, getattr(data, qty_name, 0) + qty)
+
+
+	def _check_reasons(self, records=None):
+		"""
+		Find the reasons of all the records in one pass. Rules from 'reason_rules' registry
+		are checked in order of priority and the first matching one gives the reason
+		:param records: Records to check, all the 'self.reports_data' by default
+		:return: Number of records which reason is found
+		"""
+		rules = self._reason_rules()
+		if records is None:
+			records = self.reports_data.itervalues()
+		found_count = 0
+		for data in records:
+			for predicate, reason_code in rules:
+				if predicate(data):
+					data.reason_code = reason_code
+					data.reason_found = True
+					found_count += 1
+					break
+		return found_count
+
+
+	def _reason_rules(self):
+		# Rules in order of priority with the codes of their reasons
+		return [(predicate, ReportRecord.reason_code_of(reason))
+				for predicate, reason in compile_reason_rules(REASON_RULES, self.reasons)]
+
+
+	def _check_reasons_columnar(self):
+		print 'Check reasons (columnar)'
+		return self.columnar_reports.check_reasons(self.reasons)
+
+
+	def _make_output_file(self, rows=None):
+		"""
+		:param rows: Sorted result rows, the rows of 'self.reports_data' by default
+		:return: Number of the output rows
+		"""
+		output_file_name = self._output_file_name('Order_Discrepancy_comparison_result')
+		if rows is None:
+			rows = self._sorted_result_rows()
+
+		rows_count = 0
+		with self.output_writer(output_file_name, self.OUTPUT_COLUMNS) as writer:
+			for rows_count, item in enumerate(rows, 1):
+				writer.write_row(item)
+			if self.metrics_sheet:
+				# The output stage itself is not finished yet, it's in the metrics file only
+				writer.write_sheet('Run Metrics', METRICS_COLUMNS, self.metrics.rows())
+		self.output_file_name = writer.file_name
+
+		print 'Compare files has just been finished! Check the \'{file_name}\' to see the result'.format(file_name=writer.file_name)
+		return rows_count
+
+
+	def _output_file_name(self, prefix):
+		output_file_name = "{prefix}_{date}".format(prefix=prefix, date=datetime.now())
+		if self.output_dir:
+			output_file_name = os.path.join(self.output_dir, output_file_name)
+		return output_file_name
 
-		for item in sorted_result_by_status_and_order_qty:
-			output_sheet.append(item)
 
-		output_file_name = "Order_Discrepancy_comparison_result_{date}.xlsx".format(date=datetime.now())	
+	def _iter_result_rows(self):
+		return starmap(self._result_row, self.reports_data.iteritems())
 
-		output_file.save(output_file_name)
 
-		print 'Compare files has just been finished! Check the \'{file_name}\' to see the result'.format(file_name=output_file_name)
+	@staticmethod
+	def _result_row(order_sku, data):
+		order_id, sku = order_sku
+		return [
+			order_id, 
+			sku,				
+			str(getattr(data, 'order_qty', ' ')), 
+			str(getattr(data, 'refund_qty', ' ')),
+			str(getattr(data, 'returned_qty', ' ')), 
+			str(getattr(data, 'reimbursed_qty', ' ')),
+			data.is_in,
+			data.status,				
+			getattr(data, 'missing_in', None), 				
+			getattr(data, 'reason', None)
+		]
+
+
+	@staticmethod
+	def _output_sort_key(row):
+		return row[6], row[2]
+
+
+	def _sorted_result_rows(self):
+		"""
+		Result rows sorted by status and order qty.
+		Up to 'self.output_sort_limit' rows are sorted in memory, bigger results are sorted 
+		in runs of that size which are spilled to temporary files and merged while writing
+		"""
+		sort_key = self._output_sort_key
+		if len(self.reports_data) <= self.output_sort_limit:
+			return sorted(self._iter_result_rows(), key=sort_key, reverse=True)
+		return external_sort.external_sort(self._iter_result_rows(), sort_key, self.output_sort_limit, reverse=True)
 
 
 
 	def run_script(self):
-		self._read_reports_data_from_files()
-		self._find_missing_data()		
-		self._get_reports_data_info_from_debug()
-		self._check_not_in_debug_reason()
-		self._check_refund_without_order_reason()
-		self._check_refunds_qty_greater_than_orders_reason()
-		self._check_should_be_in_report_reason()
-		self._make_output_file()
+		metrics = self.metrics
+		try:
+			with metrics.stage('read_columns'):
+				self._read_columns()
+			with metrics.stage('read_versions') as stage:
+				self._read_reports_data_from_files()
+				stage.rows_in = sum(self.old_data_order_skus.itervalues()) + sum(self.new_data_order_skus.itervalues())
+				stage.rows_out = len(self.old_data_order_skus) + len(self.new_data_order_skus)
+			with metrics.stage('find_missing_data') as stage:
+				self._find_missing_data()
+				stage.rows_in = len(self.old_data_order_skus) + len(self.new_data_order_skus)
+				stage.rows_out = len(self.reports_data)
+				stage.keys_matched = stage.rows_in - stage.rows_out
+			with metrics.stage('debug_join') as stage:
+				stage.rows_in, stage.keys_matched = self._get_reports_data_info_from_debug()
+				stage.rows_out = len(self.reports_data)
+		except:
+			# Worker processes left running would keep the script from exiting
+			if self.parallel_reader:
+				self.parallel_reader.terminate()
+			raise
+		with metrics.stage('check_reasons') as stage:
+			stage.rows_in = len(self.reports_data)
+			if self.engine == 'columnar':
+				stage.rows_out = self._check_reasons_columnar()
+			else:
+				print 'Check reasons'
+				stage.rows_out = self._check_reasons()
+		with metrics.stage('output') as stage:
+			stage.rows_in = len(self.reports_data)
+			stage.rows_out = self._make_output_file()
+		if self.state_file:
+			with metrics.stage('save_state'):
+				self._save_state()
+		if self.metrics_file:
+			metrics.save(self.metrics_file)
+			print 'Run metrics have been saved to \'{}\''.format(self.metrics_file)
 
 
+	def run_streaming(self):
+		"""
+		Run the comparison as a streaming pipeline: the versions readers, the diff and debug join,
+		the reasons check and the output writer are stages running at the same time in threads,
+		connected by bounded queues of row batches (see 'pipeline'). Debug sheets are parsed by their own
+		stages (by 'workers' processes if it's set) while the versions are read.
+		Output rows are written as soon as their reasons are found, so they are not sorted
+		and the first ones are written before the last records are made.
+		The run state is not saved and reasons are checked by the 'dict' engine whatever 'self.engine' is.
+		The pipeline stages run at the same time, so they are measured as one 'pipeline' stage of the run metrics,
+		its profile has the output writer only (cProfile profiles the thread it's started in).
+		"""
+		if self.state_file:
+			raise ValueError('Streaming run does not save the run state, use \'run_script\' with \'state_file\'')
+		if self.metrics_sheet:
+			raise ValueError('Streaming run writes the output before its metrics are known, use \'metrics_file\'')
+		self._require_debug_files()
+		metrics = self.metrics
+		with metrics.stage('read_columns'):
+			self._read_columns()
+		start = time.time()
 
+		pipeline = Pipeline()
+		self.parallel_reader = parallel_reader.ParallelReader(self.workers, cache=self.cache)
+		try:
+			with metrics.stage('pipeline') as stage:
+				debug_sheets = [pipeline.stage(self._stream_debug_sheet, debug_sheet) for debug_sheet in DEBUG_SHEETS]
+				old_keys = pipeline.stage(self._stream_version_keys, 'old_version')
+				new_keys = pipeline.stage(self._stream_version_keys, 'new_version')
+				records = pipeline.stage(self._stream_records, old_keys, new_keys, debug_sheets)
+				rows = pipeline.stage(self._stream_result_rows, records)
 
+				output_file_name = self._output_file_name('Order_Discrepancy_comparison_result')
+				stage.rows_out = 0
+				with self.output_writer(output_file_name, self.OUTPUT_COLUMNS) as writer:
+					for batch_number, batch in enumerate(rows):
+						if not batch_number:
+							print 'First output rows are ready in {:.2f}s'.format(time.time() - start)
+						for row in batch:
+							writer.write_row(row)
+						stage.rows_out += len(batch)
+				pipeline.join()
+		except:
+			self.parallel_reader.terminate()
+			raise
+		self.parallel_reader.close()
+		self.output_file_name = writer.file_name
 
-if __name__ == '__main__':
-	Jacob_data = OrderDiscrepancyComparisonScript(
-		old_version=OLD_VERSION,
-    	new_version=NEW_VERSION,
-	  	reimbursements=DEBUG_REPORT_REIMBURSEMENTS,
-	  	returns_to_fba=DEBUG_REPORT_RETURNS_TO_FBA,
-	  	date_range=DEBUG_REPORT_DATE_RANGE,
-	  )
-	Jacob_data.run_script()
-	
+		print 'Compare files has just been finished! Check the \'{file_name}\' to see the result'.format(file_name=writer.file_name)
+		if self.metrics_file:
+			metrics.save(self.metrics_file)
+			print 'Run metrics have been saved to \'{}\''.format(self.metrics_file)
+
+
+	def _stream_debug_sheet(self, debug_sheet):
+		# Yields the only item: the sheet parsed into a dict of (order_id, sku) to its quantities
+		if debug_sheet in self.debug_aggregates:
+			partials = self.debug_aggregates[debug_sheet]
+		else:
+			debug_file = getattr(self, debug_sheet)
+			partials = self.parallel_reader.submit(debug_sheet, debug_file, self.columns[debug_sheet]).get()
+		yield parallel_reader.merge_partials(debug_sheet, partials)
+
+
+	def _stream_version_keys(self, version):
+		# Batches of (order_id, sku) of the version rows, empty ones are skipped
+		with open(getattr(self, version), 'rb') as csvfile:
+			rows = csv_scanner.scan_rows(csvfile, self.columns[version])
+			next(rows, None) # not to read column titles
+			while True:
+				batch = list(islice(rows, BATCH_SIZE))
+				if not batch:
+					break
+				yield [order_sku for order_sku in batch if order_sku[0] and order_sku[1]]
+
+
+	def _stream_records(self, old_keys, new_keys, debug_sheets):
+		"""
+		Diff and debug join stage: count the keys of both versions, then yield batches of (order_id, sku)
+		and its ReportRecord with status and debug quantities
+		"""
+		old_counts = Counter()
+		for batch in old_keys:
+			old_counts.update(batch)
+		new_counts = Counter()
+		for batch in new_keys:
+			new_counts.update(batch)
+		debug_sheets = [next(parsed_sheet) for parsed_sheet in debug_sheets]
+		add_debug_qty = self.add_debug_qty
+
+		version_filenames = self._version_filenames()
+		set_status = self._set_status
+		order_skus = iter(set(old_counts).union(new_counts))
+		while True:
+			batch = []
+			for order_sku in islice(order_skus, BATCH_SIZE):
+				data = ReportRecord()
+				set_status(data, old_counts.get(order_sku, 0), new_counts.get(order_sku, 0), version_filenames)
+				for parsed_sheet in debug_sheets:
+					quantities = parsed_sheet.get(order_sku)
+					if quantities is not None:
+						add_debug_qty(data, None, 0)
+						for qty_name, qty in quantities.iteritems():
+							add_debug_qty(data, qty_name, qty)
+				batch.append((order_sku, data))
+			if not batch:
+				break
+			yield batch
+
+
+	def _stream_result_rows(self, records):
+		# Reasons stage: find the reasons of the records and yield batches of the output rows
+		for batch in records:
+			self._check_reasons(data for _, data in batch)
+			yield list(starmap(self._result_row, batch))
 
+
+	def run_out_of_core(self):
+		"""
+		Compare reports which don't fit into memory. The rows of all the input files are split
+		into hash partitions of (order_id, sku) spilled to temporary files (see 'partition_spill'),
+		then the partitions are compared one by one: the diff, the debug join and the reasons check
+		of a partition take its keys only. The sorted output rows of each partition are spilled as a run
+		and the runs are merged into the output file, so the result is the same as of 'run_script'.
+		The number of partitions is chosen so the data of one partition fits into 'self.memory_budget'.
+
+		With 'workers' the partitions are shards compared in parallel by that many processes,
+		the budget is shared by them and there are at least as many partitions as workers.
+		Input files are read one by one and reasons are checked by the 'dict' engine whatever 'self.engine' is.
+		The run state is not saved.
+		"""
+		if self.state_file:
+			raise ValueError('Out-of-core run does not save the run state, use \'run_script\' with \'state_file\'')
+		self._require_debug_files()
+		metrics = self.metrics
+		with metrics.stage('read_columns'):
+			self._read_columns()
+
+		workers = self.workers or 1
+		version_rows = sum(estimate_rows(getattr(self, version)) for version in ('old_version', 'new_version'))
+		partitions = int(math.ceil(version_rows * self.VERSION_ROW_MEMORY * workers / float(self.memory_budget)))
+		partitions = max(workers, partitions + (-partitions % workers)) # The same number of partitions for each worker
+		spill = PartitionSpill(partitions, max(1000, self.memory_budget // (4 * self.VERSION_ROW_MEMORY)))
+		run_files = []
+		try:
+			print 'Splitting the input files into {} partitions...'.format(partitions)
+			with metrics.stage('spill') as stage:
+				# Versions are the first sources, so they are read back before the debug rows of a partition
+				stage.rows_in = sum(self._spill_input(spill, source, input_name) for source, input_name in enumerate(INPUTS))
+				stage.rows_out = partitions
+
+			with metrics.stage('partitions') as stage:
+				results = self._compare_partitions(spill)
+				run_files.extend(open(run_path, 'rb') for run_path, _, _ in results)
+				stage.rows_out = sum(keys_count for _, keys_count, _ in results)
+				stage.keys_matched = sum(debug_keys_count for _, _, debug_keys_count in results)
+
+			with metrics.stage('output') as stage:
+				stage.rows_out = self._make_output_file(external_sort.merge_runs(run_files, self._output_sort_key, reverse=True))
+		finally:
+			for run_file in run_files:
+				run_file.close()
+			spill.close()
+		if self.metrics_file:
+			metrics.save(self.metrics_file)
+			print 'Run metrics have been saved to \'{}\''.format(self.metrics_file)
+
+
+	def _compare_partitions(self, spill):
+		"""
+		Compare all the partitions of the spill, in a pool of 'self.workers' processes if it's set
+		:return: A list of the '_compare_spilled_partition' results in the order of the partitions
+		"""
+		partitions = xrange(spill.partitions)
+		# Worker processes get the comparison and the spill by their initializer, as they are not forked on every platform
+		if self.workers:
+			pool = multiprocessing.Pool(self.workers, _init_out_of_core_process, (self, spill))
+		else:
+			pool = None
+			_init_out_of_core_process(self, spill)
+		try:
+			if pool is None:
+				return map(_compare_spilled_partition, partitions)
+			return pool.map(_compare_spilled_partition, partitions, chunksize=1)
+		except:
+			if pool is not None:
+				pool.terminate()
+			raise
+		finally:
+			if pool is not None:
+				pool.close()
+				pool.join()
+			_out_of_core_run.clear()
+
+
+	def _spill_input(self, spill, source, input_name):
+		# Split the rows of an input file into the partitions, version rows without order_id or sku are skipped
+		path = getattr(self, input_name)
+		if xlsx_reader.is_workbook(path):
+			return spill.add_rows(source, xlsx_reader.sheet_rows(path, input_name, self.columns[input_name]))
+
+		with open(path, 'rb') as csvfile:
+			rows = csv_scanner.scan_rows(csvfile, self.columns[input_name])
+			next(rows, None) # not to read column titles
+			if _input_kind(input_name) == 'version':
+				rows = ifilter(all, rows)
+			return spill.add_rows(source, rows)
+
+
+	def _compare_partition(self, chunks):
+		"""
+		Compare the keys of one partition and find their reasons, its records are put to 'self.reports_data'
+		:param chunks: (source, rows) chunks of the partition, a source is a number of INPUTS
+		"""
+		self.old_data_order_skus = Counter()
+		self.new_data_order_skus = Counter()
+		self.reports_data = {}
+		version_counts = (self.old_data_order_skus, self.new_data_order_skus)
+
+		missing_data_found = False
+		for source, rows in chunks:
+			if source < len(version_counts):
+				version_counts[source].update(rows)
+				continue
+			if not missing_data_found:
+				self._find_missing_data()
+				missing_data_found = True
+			_join_debug_rows(rows, ROW_QUANTITIES[INPUTS[source]], self.reports_data, self.add_debug_qty)
+		if not missing_data_found:
+			self._find_missing_data()
+		self._check_reasons()
+
+
+	def build_lookup_index(self, index_file):
+		"""
+		Parse all the input files and save them to a lookup index (see 'lookup_index'),
+		so a single key can be explained by 'lookup' at once. The index is replaced if it exists
+		"""
+		self._read_columns()
+		reader = parallel_reader.ParallelReader(self.workers, cache=self.cache)
+		try:
+			parsed = dict(
+				(input_name, reader.submit(_input_kind(input_name), getattr(self, input_name), self.columns[input_name]))
+				for input_name in INPUTS if getattr(self, input_name)
+			)
+			old_counts = parallel_reader.merge_version(parsed.pop('old_version').get())
+			new_counts = parallel_reader.merge_version(parsed.pop('new_version').get())
+			debug_sheets = [
+				parallel_reader.merge_partials(debug_sheet, parsed[debug_sheet].get()) for debug_sheet in DEBUG_SHEETS
+				if debug_sheet in parsed
+			]
+		except:
+			reader.terminate()
+			raise
+		reader.close()
+
+		inputs = dict((input_name, os.path.abspath(getattr(self, input_name))) for input_name in INPUTS if getattr(self, input_name))
+		lookup_index.save_index(index_file, inputs, old_counts, new_counts, debug_sheets)
+		print 'Lookup index of {} keys has been saved to \'{}\''.format(len(set(old_counts).union(new_counts)), index_file)
+
+
+	@classmethod
+	def lookup(cls, index_file, order_id, sku):
+		"""
+		Explain one key by a lookup index made by 'build_lookup_index': its status and reason
+		are found by the same rules as in a comparison run
+		:return: An OrderedDict of the output file columns to the key values, or None if the key is in neither version
+		"""
+		with lookup_index.LookupIndex(index_file) as index:
+			found = index.get(order_id, sku)
+			inputs = index.inputs()
+		if found is None:
+			return None
+		old_count, new_count, in_debug, quantities = found
+
+		comparison = cls(**inputs)
+		data = ReportRecord()
+		comparison._set_status(data, old_count, new_count, comparison._version_filenames())
+		if in_debug:
+			data.in_debug = True
+		for qty_name, qty in quantities.iteritems():
+			setattr(data, qty_name, qty)
+		comparison._check_reasons([data])
+		return OrderedDict(zip([title for title, width in cls.OUTPUT_COLUMNS], cls._result_row((order_id, sku), data)))
+
+
+	def _save_state(self):
+		# All the input files are parsed by parallel_reader when 'state_file' is set
+		parsed = {
+			'old_version': dict(self.old_data_order_skus),
+			'new_version': dict(self.new_data_order_skus),
+		}
+		for debug_sheet in DEBUG_SHEETS:
+			parsed[debug_sheet] = parallel_reader.merge_partials(debug_sheet, self.debug_aggregates[debug_sheet])
+		incremental_state.save_state(self.state_file, parsed, self.reports_data)
+		print 'Run state has been saved to \'{}\''.format(self.state_file)
+
+
+	def run_incremental(self, changed_input):
+		"""
+		Compare again after one input file has got a new revision, using the state saved by the previous run
+		to 'self.state_file'. Only the changed file is parsed, status and reason are recomputed only for the keys
+		which parsed data has changed, the other records are taken from the state.
+		The full result is written as usual, keys which status or reason has changed are written to
+		'Order_Discrepancy_changelog_<datetime>' file. The state is updated for the next run.
+		Reasons are checked by the 'dict' engine whatever 'self.engine' is.
+
+		:param changed_input: Name of the changed input: 'old_version', 'new_version', 'reimbursements',
+			'returns_to_fba' or 'date_range', its new revision is the file given to the constructor
+		"""
+		if changed_input not in INPUTS:
+			raise ValueError('Unknown input \'{}\'. Choose one of these: {}'.format(changed_input, ', '.join(INPUTS)))
+		if not self.state_file:
+			raise ValueError('Incremental run needs the state of the previous run, give its \'state_file\'')
+		metrics = self.metrics
+		with metrics.stage('load_state') as stage:
+			state = incremental_state.load_state(self.state_file)
+			parsed = state['parsed']
+			stage.rows_out = len(state['records'])
+
+		print 'Parsing the new revision of {}...'.format(changed_input)
+		kind = _input_kind(changed_input)
+		with metrics.stage('read_revision') as stage:
+			reader = parallel_reader.ParallelReader(self.workers, cache=self.cache)
+			try:
+				revision = parallel_reader.merge_partials(kind, reader.submit(kind, getattr(self, changed_input)).get())
+			finally:
+				reader.close()
+			changed_keys = incremental_state.changed_keys(parsed[changed_input], revision)
+			parsed[changed_input] = revision
+			stage.rows_out = len(changed_keys)
+		print '{} keys have changed'.format(len(changed_keys))
+
+		# Unchanged records keep their status and reason, version labels follow the current file names
+		version_filenames = self._version_filenames()
+		for order_sku, values in state['records'].iteritems():
+			if order_sku not in changed_keys:
+				data = self.reports_data[order_sku] = incremental_state.restore_record(values)
+				self._set_version_labels(data, version_filenames)
+
+		changed_records = []
+		with metrics.stage('check_reasons') as stage:
+			for order_sku in changed_keys:
+				old_count = parsed['old_version'].get(order_sku, 0)
+				new_count = parsed['new_version'].get(order_sku, 0)
+				if not old_count and not new_count:
+					continue # The key is in neither version now
+				data = self.reports_data[order_sku] = ReportRecord()
+				self._set_status(data, old_count, new_count, version_filenames)
+				for debug_sheet in DEBUG_SHEETS:
+					qtys = parsed[debug_sheet].get(order_sku)
+					if qtys is not None:
+						self.add_debug_qty(data, None, 0)
+						for qty_name, qty in qtys.iteritems():
+							self.add_debug_qty(data, qty_name, qty)
+				changed_records.append(data)
+			print 'Check reasons of {} changed keys'.format(len(changed_records))
+			stage.rows_in = len(changed_records)
+			stage.rows_out = self._check_reasons(changed_records)
+
+		with metrics.stage('output') as stage:
+			stage.rows_in = len(self.reports_data)
+			stage.rows_out = self._make_output_file()
+			self._make_changelog_file(state['records'], changed_keys)
+		with metrics.stage('save_state'):
+			incremental_state.save_state(self.state_file, parsed, self.reports_data)
+		print 'Run state has been saved to \'{}\''.format(self.state_file)
+		if self.metrics_file:
+			metrics.save(self.metrics_file)
+			print 'Run metrics have been saved to \'{}\''.format(self.metrics_file)
+
+
+	def _make_changelog_file(self, previous_records, changed_keys):
+		"""
+		Write keys which status or reason differs from the previous run, sorted by (order_id, sku).
+		Keys which are added or removed have an empty previous or current status
+		"""
+		status_index = incremental_state.RECORD_FIELDS.index('status')
+		reason_index = incremental_state.RECORD_FIELDS.index('reason')
+		changelog_file_name = self._output_file_name('Order_Discrepancy_changelog')
+		changes_count = 0
+		with self.output_writer(changelog_file_name, self.CHANGELOG_COLUMNS) as writer:
+			for order_sku in sorted(changed_keys):
+				previous = previous_records.get(order_sku)
+				previous_status, previous_reason = (previous[status_index], previous[reason_index]) if previous else ('', None)
+				data = self.reports_data.get(order_sku)
+				status, reason = (data.status, getattr(data, 'reason', None)) if data else ('', None)
+				if (previous_status, previous_reason) != (status, reason):
+					changes_count += 1
+					writer.write_row([order_sku[0], order_sku[1], previous_status, status, previous_reason, reason])
+		self.changelog_file_name = writer.file_name
+
+		print '{} keys have changed status or reason, see \'{}\''.format(changes_count, writer.file_name)
+
+
+
+
+
+INPUTS = ('old_version', 'new_version') + DEBUG_SHEETS
+
+# The comparison and the partitions spill of the running out-of-core run set by '_init_out_of_core_process':
+# {'comparison': ..., 'spill': ...}
+_out_of_core_run = {}
+
+
+
+def _input_kind(input_name):
+	# Both versions are files of the same kind, a debug sheet is a kind of its own
+	return 'version' if input_name in ('old_version', 'new_version') else input_name
+
+
+def _join_debug_rows(rows, row_quantity, index, add_debug_qty):
+	"""
+	Add the quantities of debug sheet rows to the keys of 'index', rows of other keys are dropped
+	before their quantities are parsed. See '_join_debug_sheet' for the arguments
+	:return: A tuple of (rows read, rows matched)
+	"""
+	rows_count = matched_count = 0
+	for row in rows:
+		rows_count += 1
+		data = index.get(row[:2])
+		if data is None:
+			continue
+		matched_count += 1
+		qty_name, qty = row_quantity(row)
+		add_debug_qty(data, qty_name, qty)
+	return rows_count, matched_count
+
+
+def _init_out_of_core_process(comparison, spill):
+	_out_of_core_run.update(comparison=comparison, spill=spill)
+
+
+def _compare_spilled_partition(partition):
+	"""
+	Compare a partition of the out-of-core run and write its sorted output rows to a run file of the spill,
+	it's run by the worker processes of the run as well
+	:return: A tuple of (run file path, keys count, keys found in debug)
+	"""
+	comparison, spill = _out_of_core_run['comparison'], _out_of_core_run['spill']
+	comparison._compare_partition(spill.chunks(partition))
+	reports_data = comparison.reports_data
+	run_path = spill.path('run_{}'.format(partition))
+	with open(run_path, 'wb') as run_file:
+		external_sort.write_run(sorted(comparison._iter_result_rows(), key=comparison._output_sort_key, reverse=True), run_file)
+	comparison.reports_data = {}
+	debug_keys_count = sum(1 for data in reports_data.itervalues() if getattr(data, 'in_debug', False))
+	return run_path, len(reports_data), debug_keys_count
+
+
+
+# OrderDiscrepancyComparisonScript arguments which are command line options of 'main'
+CLI_OPTIONS = ('output_format', 'engine', 'workers', 'output_dir', 'cache_dir', 'cache_size', 'state_file',
+			   'metrics_file', 'metrics_sheet', 'profile_dir', 'memory_budget', 'output_sort_limit')
+
+
+def main(argv=None):
+	"""
+	Command line entry point, see the module docstring. Options which are not given are not passed,
+	so a batch job keeps the arguments of its manifest and the class defaults are used
+	:return: An exit status
+	"""
+	parser = argparse.ArgumentParser(description='Compare two versions of the order discrepancy report '
+												 'and look for the reasons of the missing data in the debug report')
+	parser.add_argument('manifest', nargs='?',
+						help='A batch of comparisons instead of one: a JSON manifest or a glob of job directories')
+	parser.add_argument('concurrency', nargs='?', type=int, help='Max number of batch jobs running at the same time')
+
+	inputs = parser.add_argument_group('input files')
+	inputs.add_argument('--old-version', help='A csv file of old version of the report')
+	inputs.add_argument('--new-version', help='A csv file of new version of the report')
+	inputs.add_argument('--reimbursements', help='A csv file of \'Reimbursements\' sheet of the debug report')
+	inputs.add_argument('--returns-to-fba', help='A csv file of \'ReturnsToFBA\' sheet of the debug report')
+	inputs.add_argument('--date-range', help='A csv file of \'DateRangeCSV\' sheet of the debug report')
+	inputs.add_argument('--debug-report', help='The debug report workbook (.xlsx) to read the sheets which are not given from')
+
+	options = parser.add_argument_group('options')
+	options.add_argument('--output-format', choices=sorted(OUTPUT_WRITERS), help='xlsx by default')
+	options.add_argument('--engine', choices=OrderDiscrepancyComparisonScript.ENGINES, help='dict by default')
+	options.add_argument('--workers', type=int, help='Number of processes to parse the input files')
+	options.add_argument('--output-dir', help='A directory to put the output file into')
+	options.add_argument('--cache-dir', help='A directory of the parsed files cache')
+	options.add_argument('--cache-size', type=int, help='Max size of the parsed files cache in bytes')
+	options.add_argument('--state-file', help='A file to save the run state to for \'--incremental\' runs')
+	options.add_argument('--metrics-file', help='A JSON file to write the metrics of the run stages to')
+	options.add_argument('--metrics-sheet', action='store_true', help='Put the run metrics into the output workbook')
+	options.add_argument('--profile-dir', help='A directory to dump cProfile profiles of the run stages to')
+	options.add_argument('--memory-budget', type=int, help='Memory in bytes an \'--out-of-core\' run may take')
+	options.add_argument('--output-sort-limit', type=int, help='Max number of output rows sorted in memory')
+
+	modes = parser.add_argument_group('modes').add_mutually_exclusive_group()
+	modes.add_argument('--check', action='store_true', help='Check the inputs without running the comparison')
+	modes.add_argument('--streaming', action='store_true', help='Run the comparison as a streaming pipeline')
+	modes.add_argument('--out-of-core', action='store_true', help='Compare reports which don\'t fit into memory')
+	modes.add_argument('--incremental', choices=INPUTS, metavar='CHANGED_INPUT',
+					   help='Compare only the keys of the input changed since the run of \'--state-file\'')
+	modes.add_argument('--build-index', metavar='INDEX', help='Build a lookup index of the input files')
+	modes.add_argument('--lookup', nargs=3, metavar=('INDEX', 'ORDER_ID', 'SKU'), help='Explain one key by a lookup index')
+	modes.add_argument('--serve', nargs='?', type=int, const=0, metavar='PORT', help='Run the comparison service')
+	args = parser.parse_args(argv)
+
+	if args.lookup:
+		explanation = OrderDiscrepancyComparisonScript.lookup(*args.lookup)
+		if explanation is None:
+			return '{} {} is in neither version'.format(*args.lookup[1:])
+		for title, value in explanation.iteritems():
+			print '{:<15} {}'.format(title, value)
+		return 0
+
+	if args.serve is not None:
+		import comparison_service
+		comparison_service.serve(OrderDiscrepancyComparisonScript, args.serve or None)
+		return 0
+
+	options = dict((option, getattr(args, option)) for option in CLI_OPTIONS if getattr(args, option) not in (None, False))
+	if args.manifest:
+		import batch_runner
+		try:
+			if args.check:
+				return batch_runner.check_batch(OrderDiscrepancyComparisonScript, args.manifest, options)
+			results = batch_runner.run_batch(OrderDiscrepancyComparisonScript, args.manifest, args.concurrency, **options)
+		except (IOError, ValueError) as error:
+			# A bad manifest, a bad job fails alone
+			return 'Batch failed: {}'.format(error)
+		return 1 if any(result.error for result in results) else 0
+
+	if not (args.old_version and args.new_version):
+		parser.error('--old-version and --new-version are required to compare the reports (or a batch manifest)')
+	try:
+		comparison = OrderDiscrepancyComparisonScript(
+			args.old_version, args.new_version, args.reimbursements, args.returns_to_fba, args.date_range,
+			debug_report=args.debug_report, **options)
+		if args.check:
+			checked = comparison.check_inputs()
+		elif args.build_index:
+			comparison.build_lookup_index(args.build_index)
+		elif args.streaming:
+			comparison.run_streaming()
+		elif args.out_of_core:
+			comparison.run_out_of_core()
+		elif args.incremental:
+			comparison.run_incremental(args.incremental)
+		else:
+			comparison.run_script()
+	except (EOFError, IOError, ValueError, ImportError) as error:
+		# Bad input files or options, the traceback wouldn't tell more than the message
+		return '{} failed: {}'.format('Check' if args.check else 'Comparison', error)
+
+	if args.check:
+		for input_name, input_file in checked:
+			print '{:<15} {}'.format(input_name, input_file)
+		print 'Inputs are fine'
+	return 0
+
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,65 @@
+import os
+
+from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The modules of the repository root are installed as one package, so their names (pipeline, report_cache, ...)
+# don't collide with other installed modules. They import each other by implicit relative imports,
+# which find the modules of the package first
+PACKAGE = 'order_discrepancy'
+
+MODULES = [
+	'batch_runner', 'columnar_engine', 'compare_cli', 'comparison_service', 'csv_scanner', 'external_sort',
+	'incremental_state', 'lookup_index', 'output_writers', 'parallel_reader', 'partition_spill', 'pipeline',
+	'reason_rules', 'report_cache', 'report_record', 'report_schema', 'run_metrics', 'xlsx_reader',
+]
+
+# 'script_v1.4.py' is not a valid module name, it's package data loaded by 'compare_cli'
+SCRIPT_FILE = 'script_v1.4.py'
+
+
+class BuildPackage(build_py):
+	"""
+	Builds the package of MODULES only, the root of the repository has other files
+	and no '__init__.py', an empty one is written to the package
+	"""
+
+	def find_package_modules(self, package, package_dir):
+		return [(package, module, os.path.join(package_dir, module + '.py')) for module in MODULES]
+
+	def check_package(self, package, package_dir):
+		return None
+
+	def run(self):
+		build_py.run(self)
+		open(self._init_file(), 'wb').close()
+
+	def get_outputs(self, include_bytecode=1):
+		return build_py.get_outputs(self, include_bytecode) + [self._init_file()]
+
+	def _init_file(self):
+		return os.path.join(self.build_lib, PACKAGE, '__init__.py')
+
+
+setup(
+	name='order-discrepancy-compare',
+	version='1.4',
+	description='Compare versions of the order discrepancy report and find the reasons of the missing data',
+	python_requires='>=2.7, <3',
+	packages=[PACKAGE],
+	package_dir={PACKAGE: '.'},
+	package_data={PACKAGE: [SCRIPT_FILE]},
+	# openpyxl writes the default xlsx output, it's imported only when a workbook is read or written
+	install_requires=['openpyxl>=2.6'],
+	extras_require={
+		'columnar': ['numpy'],
+		'parquet': ['pyarrow'],
+	},
+	cmdclass={'build_py': BuildPackage},
+	entry_points={
+		'console_scripts': ['order-discrepancy-compare = {}.compare_cli:main'.format(PACKAGE)],
+	},
+)
@@ -0,0 +1,121 @@
+import os
+import zipfile
+
+
+"""
+
+Streaming reader of the debug report workbook (.xlsx) of OrderDiscrepancyComparisonScript,
+so its 'Reimbursements', 'ReturnsToFBA' and 'DateRangeCSV' sheets don't need to be exported to csv files.
+A sheet is read row by row by openpyxl in read-only mode, only up to the last column needed,
+so memory doesn't grow with the number of rows. Each sheet is opened on its own,
+so the sheets can be read by different processes at the same time (see parallel_reader).
+
+Cells are converted to text as they are in a csv export: an empty cell is '', a whole number is '3'.
+
+"""
+
+# Sheets of the debug report by the file kinds
+SHEET_NAMES = {
+	'reimbursements': 'Reimbursements',
+	'returns_to_fba': 'ReturnsToFBA',
+	'date_range': 'DateRangeCSV',
+}
+
+# Headers of the sheets of the workbooks already opened: {(path, size, mtime): {kind: header}},
+# a long-running process drops the ones it doesn't need by 'forget_headers'
+_headers = {}
+
+
+def is_workbook(path):
+	return path.lower().endswith('.xlsx')
+
+
+def check_sheets(path, kinds):
+	"""
+	Make sure the workbook has the sheets of 'kinds' without loading openpyxl, e.g. for a dry run.
+	Sheet names are read from the workbook part of the xlsx zip, the headers are not read
+	"""
+	try:
+		with zipfile.ZipFile(path) as workbook:
+			workbook_xml = workbook.read('xl/workbook.xml')
+	except (zipfile.BadZipfile, KeyError):
+		raise ValueError('{}: the debug report is not an xlsx workbook'.format(path))
+
+	from xml.etree import cElementTree
+	sheet_names = set(element.get('name') for element in cElementTree.fromstring(workbook_xml).iter()
+					  if element.tag.endswith('}sheet'))
+	for kind in kinds:
+		if SHEET_NAMES[kind] not in sheet_names:
+			raise ValueError('{}: there is no \'{}\' sheet in the debug report'.format(path, SHEET_NAMES[kind]))
+
+
+def _load_workbook(path):
+	try:
+		import openpyxl
+	except ImportError:
+		raise ImportError('Reading the debug report workbook needs openpyxl, install it or export its sheets to csv files')
+	return openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+
+def _sheet(workbook, path, kind):
+	sheet_name = SHEET_NAMES[kind]
+	if sheet_name not in workbook.sheetnames:
+		raise ValueError('{}: there is no \'{}\' sheet in the debug report'.format(path, sheet_name))
+	return workbook[sheet_name]
+
+
+def read_header(path, kind):
+	"""
+	:return: Column titles of the sheet of 'kind'. Headers of all the sheets are read at once,
+		so the workbook is opened once for them
+	"""
+	stat = os.stat(path)
+	workbook_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+	if workbook_key not in _headers:
+		workbook = _load_workbook(path)
+		try:
+			_headers[workbook_key] = dict(
+				(sheet_kind, [_text(value) for value in next(sheet.iter_rows(max_row=1, values_only=True), ())])
+				for sheet_kind, sheet in _sheets(workbook))
+		finally:
+			workbook.close()
+
+	headers = _headers[workbook_key]
+	if kind not in headers:
+		raise ValueError('{}: there is no \'{}\' sheet in the debug report'.format(path, SHEET_NAMES[kind]))
+	return headers[kind]
+
+
+def forget_headers(path, size, mtime):
+	# Drop the headers of a workbook revision, e.g. when its parsed sheets are evicted from memory
+	_headers.pop((os.path.abspath(path), size, mtime), None)
+
+
+def _sheets(workbook):
+	for kind, sheet_name in SHEET_NAMES.iteritems():
+		if sheet_name in workbook.sheetnames:
+			yield kind, workbook[sheet_name]
+
+
+def sheet_rows(path, kind, columns):
+	"""
+	Rows of the sheet of 'kind' without column titles, a row is a tuple of 'columns' values
+	as csv_scanner gives them
+	"""
+	workbook = _load_workbook(path)
+	try:
+		sheet = _sheet(workbook, path, kind)
+		for row in sheet.iter_rows(min_row=2, max_col=max(columns) + 1, values_only=True):
+			yield tuple([_text(row[column]) for column in columns])
+	finally:
+		workbook.close()
+
+
+def _text(value):
+	if value is None:
+		return ''
+	if isinstance(value, float) and value.is_integer():
+		value = int(value)
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	return str(value)